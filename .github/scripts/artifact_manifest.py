@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from input_hashes import compute_input_hashes
+from metrics import count
+
+MANIFEST_FILE = "artifact-manifest.json"
+MANIFEST_VERSION = 1
+SOURCE_INFO_FILE = "keiyoushi-source-info.json"
+APK_DIR = "outputs/apk/release"
+JAR_DIR = "outputs/jar/release"
+HASH_BLOCK_SIZE = 1024 * 1024
+HASH_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+# v1 signature files. The APK signing block isn't in the central directory at all.
+SIGNATURE_FILE_REGEX = re.compile(
+    r"^META-INF/([^/]+\.(SF|RSA|DSA|EC)|MANIFEST\.MF)$", re.IGNORECASE
+)
+
+# (source info, apk, jar) for one built extension.
+Artifact = tuple[dict, Path, Path]
+
+
+def sha256_file(path: Path) -> str:
+    # Stream in fixed-size blocks; hashlib releases the GIL so this parallelizes on threads.
+    digest = hashlib.sha256()
+    with path.open("rb", buffering=0) as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    count("bytes hashed", path.stat().st_size)
+    return digest.hexdigest()
+
+
+def hash_files(files: list[Path]) -> dict[Path, str]:
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        return dict(zip(files, executor.map(sha256_file, files)))
+
+
+def zip_content_hash(path: Path) -> str:
+    """
+    returns a digest of the names, CRC32s and sizes of a zip's entries, read
+    from its central directory without decompressing anything. signature
+    files, timestamps and entry order don't count, so a rebuild with the same
+    payload gets the same digest
+    """
+    with zipfile.ZipFile(path) as archive:
+        entries = sorted(
+            f"{entry.filename}\0{entry.CRC:08x}\0{entry.file_size}"
+            for entry in archive.infolist()
+            if not SIGNATURE_FILE_REGEX.match(entry.filename)
+        )
+    count("zip directories read")
+    return hashlib.sha256("\n".join(entries).encode()).hexdigest()
+
+
+def hash_zip_contents(files: list[Path]) -> dict[Path, str]:
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        return dict(zip(files, executor.map(zip_content_hash, files)))
+
+
+def find_outputs(build_dir: Path, package_name: str) -> tuple[Path, Path]:
+    """
+    returns the release apk and jar an assembleRelease left in a build dir
+    """
+    apk = next((build_dir / APK_DIR).glob("*.apk"), None)
+    if apk is None:
+        raise FileNotFoundError(
+            f"{package_name}: no release apk found under {build_dir}"
+        )
+
+    jar = next((build_dir / JAR_DIR).glob("*.jar"), None)
+    if jar is None:
+        raise FileNotFoundError(
+            f"{package_name}: no release jar found under {build_dir}"
+        )
+
+    return apk, jar
+
+
+def load_info(info_file: Path) -> dict:
+    with info_file.open(encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_build_dir(module: str) -> Path:
+    """
+    maps a gradle project path such as :src:en:foo to its build dir
+    """
+    return Path(*module.strip(":").split(":")) / "build"
+
+
+def write_manifest(
+    modules: list[str],
+    root: Path = Path("."),
+    input_hashes: dict[str, str] | None = None,
+) -> Path:
+    """
+    records the source info, apk and jar of every built module together with
+    their sizes and digests, so the publisher neither walks nor hashes the
+    downloaded build directories. input hashes, when passed, are recorded
+    for the publisher to store
+    """
+    artifacts = []
+    for module in modules:
+        info_file = root / get_build_dir(module) / SOURCE_INFO_FILE
+        if not info_file.is_file():
+            # Only extensions emit source info; libs and themes have nothing to publish.
+            continue
+        info = load_info(info_file)
+        apk, jar = find_outputs(info_file.parent, info["packageName"])
+        artifacts.append((module, info_file, apk, jar))
+
+    digests = hash_files([file for *_, apk, jar in artifacts for file in (apk, jar)])
+
+    def describe(file: Path) -> dict:
+        return {
+            "path": file.relative_to(root).as_posix(),
+            "size": file.stat().st_size,
+            "sha256": digests[file],
+        }
+
+    manifest_file = root / MANIFEST_FILE
+    with manifest_file.open("w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": MANIFEST_VERSION,
+                "artifacts": [
+                    {
+                        "module": module,
+                        "info": info_file.relative_to(root).as_posix(),
+                        "apk": describe(apk),
+                        "jar": describe(jar),
+                    }
+                    | (
+                        {"inputHash": input_hashes[module]}
+                        if input_hashes and module in input_hashes
+                        else {}
+                    )
+                    for module, info_file, apk, jar in artifacts
+                ],
+            },
+            f,
+            indent=2,
+        )
+    print(f"Wrote {manifest_file} with {len(artifacts)} artifacts")
+    return manifest_file
+
+
+def read_manifest(manifest_file: Path) -> tuple[list[Artifact], dict[Path, str]]:
+    """
+    returns the artifacts listed in a manifest and their recorded digests.
+    paths are relative to the manifest, and every file must still have the
+    recorded size. each module's input hash is added to its info as inputHash
+    """
+    base = manifest_file.parent
+    with manifest_file.open(encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(
+            f"{manifest_file}: unsupported manifest version {manifest.get('version')}"
+        )
+
+    artifacts = []
+    digests = {}
+    for entry in manifest["artifacts"]:
+        info = load_info(base / entry["info"])
+        if "inputHash" in entry:
+            info["inputHash"] = entry["inputHash"]
+        files = []
+        for kind in ("apk", "jar"):
+            file = base / entry[kind]["path"]
+            if file.stat().st_size != entry[kind]["size"]:
+                raise ValueError(
+                    f"{info['packageName']}: {file} doesn't match the manifest size"
+                )
+            digests[file] = entry[kind]["sha256"]
+            files.append(file)
+        artifacts.append((info, *files))
+    return artifacts, digests
+
+
+def discover_artifacts(artifacts_dir: Path) -> tuple[list[Artifact], dict[Path, str]]:
+    """
+    returns every downloaded artifact and the digests known for them. each
+    downloaded build artifact is read from its manifest when it has one,
+    and otherwise walked for source info files, leaving its files unhashed
+    """
+    artifacts = []
+    digests = {}
+    if not artifacts_dir.is_dir():
+        return artifacts, digests
+    for artifact_dir in sorted(p for p in artifacts_dir.iterdir() if p.is_dir()):
+        manifest_file = artifact_dir / MANIFEST_FILE
+        if manifest_file.is_file():
+            listed, listed_digests = read_manifest(manifest_file)
+            artifacts.extend(listed)
+            digests.update(listed_digests)
+            continue
+
+        print(f"No {MANIFEST_FILE} in {artifact_dir.name}, searching its build dirs")
+        for info_file in sorted(artifact_dir.glob(f"**/{SOURCE_INFO_FILE}")):
+            info = load_info(info_file)
+            artifacts.append(
+                (info, *find_outputs(info_file.parent, info["packageName"]))
+            )
+    return artifacts, digests
+
+
+if __name__ == "__main__":
+    write_manifest(sys.argv[1:], input_hashes=compute_input_hashes(sys.argv[1:]))
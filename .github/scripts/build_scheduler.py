@@ -0,0 +1,268 @@
+import argparse
+import heapq
+import itertools
+import json
+import math
+import os
+import subprocess
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from module_graph import build_graph, resolve_dependencies
+
+# Seconds of fixed overhead per module (task graph, dexing, signing) on top of its sources.
+DEFAULT_MODULE_COST = 20.0
+SOURCE_FILE_COST = 2.0
+TIMINGS_PATH = os.getenv("CI_MODULE_TIMINGS")
+
+
+def get_chunk_size() -> int:
+    return int(os.getenv("CI_CHUNK_SIZE", 65))
+
+
+def get_chunk_count(module_count: int) -> int:
+    """
+    returns CI_CHUNK_COUNT when set, otherwise the number of chunks
+    CI_CHUNK_SIZE would produce
+    """
+    if chunk_count := os.getenv("CI_CHUNK_COUNT"):
+        return max(1, min(int(chunk_count), module_count))
+    return math.ceil(module_count / get_chunk_size())
+
+
+def load_timings(path: str | Path | None) -> dict[str, float]:
+    """
+    returns module -> recorded build seconds, or nothing if there's no timing file
+    """
+    if not path or not Path(path).is_file():
+        return {}
+    with Path(path).open(encoding="utf-8") as f:
+        return {module: float(seconds) for module, seconds in json.load(f).items()}
+
+
+def count_source_files(ref: str | None = None) -> Counter[str]:
+    """
+    returns module -> number of tracked files under it
+    """
+    command = (
+        ["git", "ls-tree", "-r", "-z", "--name-only", ref, "--", "src", "lib-multisrc"]
+        if ref is not None
+        else ["git", "ls-files", "-z", "--", "src", "lib-multisrc"]
+    )
+    output = subprocess.run(command, capture_output=True, check=True).stdout
+    counts = Counter()
+    for path in output.decode("utf-8").split("\0"):
+        parts = path.split("/")
+        if parts[0] == "src" and len(parts) > 3:
+            counts[f":src:{parts[1]}:{parts[2]}"] += 1
+        elif parts[0] == "lib-multisrc" and len(parts) > 2:
+            counts[f":lib-multisrc:{parts[1]}"] += 1
+    return counts
+
+
+def estimate_costs(
+    modules: list[str],
+    timings: dict[str, float] | None = None,
+    head: str | None = None,
+) -> dict[str, float]:
+    """
+    returns module -> estimated build seconds. recorded timings win; other
+    modules fall back to a heuristic over their own and their theme's file count
+    """
+    timings = timings or {}
+    if all(module in timings for module in modules):
+        return {module: timings[module] for module in modules}
+
+    file_counts = count_source_files(head)
+    graph = build_graph(ref=head)
+    costs = {}
+    for module in modules:
+        if module in timings:
+            costs[module] = timings[module]
+            continue
+
+        files = file_counts[module] + sum(
+            file_counts[dependency]
+            for dependency in graph.get(module, ())
+            if dependency.startswith(":lib-multisrc:")
+        )
+        costs[module] = DEFAULT_MODULE_COST + SOURCE_FILE_COST * files
+    return costs
+
+
+def batch_chunks(modules: list[str], chunk_size: int) -> list[list[str]]:
+    return [list(chunk) for chunk in itertools.batched(modules, chunk_size)]
+
+
+def balance_chunks(
+    costs: dict[str, float],
+    chunk_count: int,
+    chunk_size: int | None = None,
+) -> list[list[str]]:
+    """
+    packs modules into chunk_count chunks by longest-processing-time-first:
+    the most expensive remaining module goes to the least loaded chunk that
+    still has room for it
+    """
+    return balance_groups([[module] for module in costs], costs, chunk_count, chunk_size)
+
+
+def balance_groups(
+    groups: list[list[str]],
+    costs: dict[str, float],
+    chunk_count: int,
+    chunk_size: int | None = None,
+) -> list[list[str]]:
+    """
+    longest-processing-time-first packing of whole groups of modules. each
+    group goes to the least loaded chunk with room for all of it, and a new
+    chunk is opened when none has
+    """
+    if not groups:
+        return []
+
+    if chunk_size is not None:
+        module_count = sum(map(len, groups))
+        chunk_count = max(chunk_count, math.ceil(module_count / chunk_size))
+    chunks = [[] for _ in range(chunk_count)]
+    heap = [(0.0, i) for i in range(chunk_count)]
+
+    def group_cost(group: list[str]) -> float:
+        return sum(costs[module] for module in group)
+
+    for group in sorted(groups, key=lambda group: (-group_cost(group), group)):
+        skipped = []
+        while heap:
+            load, i = heapq.heappop(heap)
+            if chunk_size is None or len(chunks[i]) + len(group) <= chunk_size:
+                break
+            skipped.append((load, i))
+        else:
+            load, i = 0.0, len(chunks)
+            chunks.append([])
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+
+        chunks[i].extend(group)
+        if chunk_size is None or len(chunks[i]) < chunk_size:
+            heapq.heappush(heap, (load + group_cost(group), i))
+
+    return [sorted(chunk) for chunk in chunks if chunk]
+
+
+def get_affinity_key(module: str, graph: dict[str, list[str]]) -> tuple[str, ...]:
+    """
+    returns the theme a module builds on, or else its sorted shared lib
+    dependencies. modules without either get an empty key
+    """
+    dependencies = graph.get(module, ())
+    themes = [d for d in dependencies if d.startswith(":lib-multisrc:")]
+    if themes:
+        return tuple(sorted(themes))
+    return tuple(sorted(d for d in dependencies if d.startswith(":lib:")))
+
+
+def group_by_affinity(
+    costs: dict[str, float],
+    graph: dict[str, list[str]],
+    chunk_count: int,
+    chunk_size: int | None = None,
+) -> list[list[str]]:
+    """
+    packs modules sharing a theme or lib set into the same chunks so each
+    runner compiles those upstream modules once. groups bigger than a
+    chunk's share of modules or cost are split, and modules without
+    upstream dependencies fill the remaining gaps
+    """
+    groups = defaultdict(list)
+    for module in sorted(costs):
+        groups[get_affinity_key(module, graph)].append(module)
+
+    cost_limit = sum(costs.values()) / chunk_count
+    size_limit = chunk_size or math.ceil(len(costs) / chunk_count)
+
+    pieces = [[module] for module in groups.pop((), [])]
+    for group in groups.values():
+        piece = []
+        piece_cost = 0.0
+        for module in group:
+            if piece and (
+                len(piece) >= size_limit or piece_cost + costs[module] > cost_limit
+            ):
+                pieces.append(piece)
+                piece = []
+                piece_cost = 0.0
+            piece.append(module)
+            piece_cost += costs[module]
+        pieces.append(piece)
+
+    return balance_groups(pieces, costs, chunk_count, chunk_size)
+
+
+def count_upstream(chunks: list[list[str]], graph: dict[str, list[str]]) -> list[int]:
+    """
+    returns how many distinct lib and theme modules each chunk has to compile
+    """
+    return [len(resolve_dependencies(graph, set(chunk))) for chunk in chunks]
+
+
+def get_chunk_projects(chunk: list[str], graph: dict[str, list[str]]) -> list[str]:
+    """
+    returns the gradle projects a chunk needs included: its own modules plus
+    their lib and theme dependency closure. :core and :compiler are always
+    included by the settings script
+    """
+    return sorted(
+        module
+        for module in {*chunk, *resolve_dependencies(graph, set(chunk))}
+        if module.startswith((":src:", ":lib:", ":lib-multisrc:"))
+    )
+
+
+def makespan(chunks: list[list[str]], costs: dict[str, float]) -> float:
+    return max((sum(costs[module] for module in chunk) for chunk in chunks), default=0.0)
+
+
+def benchmark(timings: dict[str, float], chunk_count: int | None = None) -> None:
+    """
+    replays recorded timings and compares the makespan and upstream
+    compilations of alphabetical batching against the other strategies
+    """
+    modules = sorted(timings)
+    graph = build_graph()
+    if chunk_count is None:
+        chunk_size = get_chunk_size()
+        chunk_count = math.ceil(len(modules) / chunk_size)
+        limit = chunk_size
+    else:
+        chunk_size = math.ceil(len(modules) / chunk_count)
+        limit = None
+
+    strategies = {
+        "batched": batch_chunks(modules, chunk_size),
+        "balanced": balance_chunks(timings, chunk_count, limit),
+        "theme": group_by_affinity(timings, graph, chunk_count, limit),
+    }
+    ideal = sum(timings.values()) / chunk_count
+
+    print(f"{len(modules)} modules, {chunk_count} chunks")
+    print(f"  lower bound: {ideal:8.1f}s")
+    for name, chunks in strategies.items():
+        print(
+            f"  {name:<11} {makespan(chunks, timings):8.1f}s ({len(chunks)} chunks, "
+            f"{sum(count_upstream(chunks, graph))} upstream compilations)"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Replay a module timing file against the chunk schedulers"
+    )
+    parser.add_argument("timings", help="JSON file mapping module -> build seconds")
+    parser.add_argument("--chunks", type=int, help="target number of chunks")
+    args = parser.parse_args()
+    benchmark(load_timings(args.timings), args.chunks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Queries over what every extension, theme and lib declares in its
+build.gradle.kts, answered from the module graph's parsed, per-file-hash
+cache:
+
+    python catalog.py theme madara
+    python catalog.py dependents :lib:cryptoaes
+    python catalog.py lang fr
+    python catalog.py show :src:en:mangadex
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from module_graph import CACHE_PATH, load_build_files, load_cache, resolve_dependents
+
+
+def format_value(value: str | int | dict) -> str:
+    return value["expr"] if isinstance(value, dict) else str(value)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Query the extension catalog")
+    parser.add_argument("--root", type=Path, default=Path("."))
+    parser.add_argument(
+        "--no-refresh",
+        action="store_true",
+        help="answer from the cached catalog without checking the build files",
+    )
+    subparsers = parser.add_subparsers(dest="query", required=True)
+    subparsers.add_parser("theme", help="extensions built on a theme").add_argument(
+        "theme"
+    )
+    subparsers.add_parser(
+        "dependents", help="modules depending on a module, transitively"
+    ).add_argument("module")
+    subparsers.add_parser("lang", help="sources of a language").add_argument("lang")
+    subparsers.add_parser("show", help="everything parsed for a module").add_argument(
+        "module"
+    )
+    args = parser.parse_args()
+
+    catalog = (
+        {module: entry["info"] for module, entry in load_cache(CACHE_PATH).items()}
+        if args.no_refresh
+        else load_build_files(args.root)
+    )
+
+    if args.query == "theme":
+        results = [m for m, info in catalog.items() if info.get("theme") == args.theme]
+    elif args.query == "dependents":
+        graph = {module: info["dependencies"] for module, info in catalog.items()}
+        results = sorted(resolve_dependents(graph, {args.module}))
+    elif args.query == "lang":
+        results = [
+            f"{module} {format_value(source.get('name', info.get('name', '')))} "
+            f"{format_value(source.get('baseUrl', ''))}"
+            for module, info in catalog.items()
+            for source in info.get("sources", [])
+            # Sources whose lang is an expression can't be matched, so they're left out.
+            if source.get("lang") == args.lang
+        ]
+    else:
+        if args.module not in catalog:
+            sys.exit(f"{args.module} isn't in the catalog")
+        results = [json.dumps(catalog[args.module], indent=2)]
+
+    if results:
+        print("\n".join(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Rules mapping changed paths outside extensions, libs and themes to what CI
+actually has to do about them. Replay them over history to check what each
+commit would have built:
+
+    python change_rules.py origin/main~200 origin/main
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+from module_graph import load_build_files
+
+# Impacts, from least to most work.
+NO_BUILD = "none"
+PUBLISH = "publish"
+LINT = "lint"
+LIB_VERSION = "libVersion"
+FULL = "full"
+IMPACT_ORDER = (NO_BUILD, PUBLISH, LINT, LIB_VERSION, FULL)
+
+# The first matching rule wins. Paths no rule matches are left to the
+# per-module handling of src/, lib/ and lib-multisrc/, and anything else
+# (README, LICENSE, .gitignore, ...) changes nothing.
+CHANGE_RULES = [
+    # scripts only run when publishing, never part of an APK
+    (
+        re.compile(
+            r"^\.github/scripts/("
+            r"publisher\.py|publish-repo\.py|index_utils\.py|index_pb2\.pyi?|index\.proto"
+            r"|github_utils\.py|artifact_manifest\.py|input_hashes\.py|module_graph\.py"
+            r"|metrics\.py)$"
+        ),
+        PUBLISH,
+    ),
+    (re.compile(r"^\.github/"), NO_BUILD),
+    (re.compile(r"^[^/]+\.md$"), NO_BUILD),
+    (re.compile(r"^ext-bootstrap\.py$"), NO_BUILD),
+    # formatting and lint configuration, plus core's unit tests
+    (
+        re.compile(
+            r"^(\.editorconfig|ktlintCodeStyle\.xml"
+            r"|gradle/build-logic/src/main/kotlin/SpotlessPlugin\.kt)$"
+        ),
+        LINT,
+    ),
+    (re.compile(r"^core/src/test/"), LINT),
+    # an extensions-lib version only reaches the modules built against it;
+    # any other line in the catalog escalates to a full rebuild
+    (re.compile(r"^gradle/libs\.versions\.toml$"), LIB_VERSION),
+    (
+        re.compile(
+            r"^(common/|compiler/|core/|gradle/|build\.gradle\.kts$"
+            r"|gradle\.properties$|settings\.gradle\.kts$)"
+        ),
+        FULL,
+    ),
+]
+
+# What used to force a full rebuild, kept so the history check can report
+# what the rules save.
+LEGACY_CORE_REGEX = re.compile(
+    r"^(common/|compiler/|core/|gradle/|build\.gradle\.kts|gradle\.properties"
+    r"|settings\.gradle\.kts|.github/scripts)"
+)
+# Checked by the history mode before replaying anything.
+RULE_EXAMPLES = {
+    ".github/scripts/cleanup-releases.py": NO_BUILD,
+    ".github/scripts/generate-build-matrices.py": NO_BUILD,
+    ".github/workflows/build_push.yml": NO_BUILD,
+    ".github/scripts/publisher.py": PUBLISH,
+    ".github/scripts/index_pb2.pyi": PUBLISH,
+    ".github/scripts/input_hashes.py": PUBLISH,
+    "CONTRIBUTING.md": NO_BUILD,
+    ".editorconfig": LINT,
+    "core/src/test/kotlin/keiyoushi/utils/NextJsTest.kt": LINT,
+    "core/src/main/kotlin/keiyoushi/utils/Json.kt": FULL,
+    "gradle/libs.versions.toml": LIB_VERSION,
+    "gradle/build-logic/src/main/kotlin/ExtensionPlugin.kt": FULL,
+    "gradle/wrapper/gradle-wrapper.properties": FULL,
+    "settings.gradle.kts": FULL,
+    "src/en/mangadex/build.gradle.kts": None,
+    "src/en/mangadex/README.md": None,
+    "lib/cryptoaes/build.gradle.kts": None,
+}
+
+LIB_VERSION_FILE = "gradle/libs.versions.toml"
+# Versions only the extensions declaring them are built against. :core and every :lib:*
+# compile against v16 and every extension links them in, so a v16 change rebuilds everything.
+ISOLATED_LIB_VERSIONS = {"1.4"}
+LIB_VERSION_ENTRY_REGEX = re.compile(r"^tachiyomi-lib-v(?P<major>\d)(?P<minor>\d+)\s*=")
+
+
+def classify_file(path: str) -> str | None:
+    """
+    returns the impact of the first rule matching path, or None when the
+    path is left to the per-module handling
+    """
+    for regex, impact in CHANGE_RULES:
+        if regex.search(path):
+            return impact
+    return None
+
+
+def get_changed_lib_versions(ref: str, head: str | None) -> set[str] | None:
+    """
+    returns the extensions-lib versions whose entries changed in the version
+    catalog, or None when any other line or a version shared by :core and
+    the libs changed too
+    """
+    command = ["git", "diff", "-U0", ref, *([head] if head else []), "--"]
+    diff = subprocess.run(
+        [*command, LIB_VERSION_FILE], capture_output=True, text=True, check=True
+    ).stdout
+
+    versions = set()
+    for line in diff.splitlines():
+        if line.startswith(("+++", "---")) or not line.startswith(("+", "-")):
+            continue
+        content = line[1:].strip()
+        if not content or content.startswith("#"):
+            continue
+        match = LIB_VERSION_ENTRY_REGEX.match(content)
+        if not match:
+            return None
+        versions.add(f"{match.group('major')}.{match.group('minor')}")
+    return versions if versions <= ISOLATED_LIB_VERSIONS else None
+
+
+def get_lib_versions(head: str | None = None) -> dict[str, str]:
+    """
+    returns module -> libVersion for every extension and theme declaring one,
+    read from git objects when head is passed
+    """
+    return {
+        module: info["libVersion"]
+        for module, info in load_build_files(ref=head).items()
+        if not module.startswith(":lib:") and isinstance(info.get("libVersion"), str)
+    }
+
+
+def classify_commit(commit: str) -> tuple[str, set[str] | None, bool]:
+    """
+    returns the impact of a commit's non-module files, the lib versions it
+    rebuilds, and whether the legacy rule would have rebuilt everything
+    """
+    output = subprocess.run(
+        ["git", "diff-tree", "--root", "-r", "-z", "--name-only", commit],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    files = [file for file in output.split("\0")[1:] if file]
+
+    impact = NO_BUILD
+    versions = set()
+    for file in files:
+        file_impact = classify_file(file)
+        if file_impact == LIB_VERSION:
+            changed = (
+                get_changed_lib_versions(f"{commit}^", commit)
+                if has_parent(commit)
+                else None
+            )
+            if changed is None:
+                file_impact = FULL
+            else:
+                versions |= changed
+        if file_impact and IMPACT_ORDER.index(file_impact) > IMPACT_ORDER.index(impact):
+            impact = file_impact
+
+    legacy = any(LEGACY_CORE_REGEX.search(file) for file in files)
+    return impact, versions if impact == LIB_VERSION else None, legacy
+
+
+def has_parent(commit: str) -> bool:
+    return (
+        subprocess.run(
+            ["git", "rev-parse", "--verify", "--quiet", f"{commit}^"],
+            capture_output=True,
+        ).returncode
+        == 0
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Check the change rules and replay them over git history"
+    )
+    parser.add_argument("base", nargs="?", help="replay commits after this ref")
+    parser.add_argument("head", nargs="?", default="HEAD")
+    args = parser.parse_args()
+
+    failures = [
+        f"{path}: expected {expected}, got {classify_file(path)}"
+        for path, expected in RULE_EXAMPLES.items()
+        if classify_file(path) != expected
+    ]
+    if failures:
+        sys.exit("Rule examples failed:\n" + "\n".join(failures))
+    print(f"{len(RULE_EXAMPLES)} rule examples pass")
+
+    revisions = f"{args.base}..{args.head}" if args.base else args.head
+    commits = subprocess.run(
+        ["git", "rev-list", "--first-parent", "--reverse", revisions],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+
+    avoided = 0
+    for commit in commits:
+        impact, versions, legacy = classify_commit(commit)
+        subject = subprocess.run(
+            ["git", "log", "-1", "--format=%h %s", commit],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        detail = f" {sorted(versions)}" if versions else ""
+        note = " (was a full rebuild)" if legacy and impact != FULL else ""
+        print(f"{impact}{detail}{note}: {subject}")
+        avoided += legacy and impact != FULL
+
+    print(f"{len(commits)} commits, {avoided} full rebuilds avoided")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,115 @@
+import argparse
+import asyncio
+import hashlib
 import json
 import time
+from collections import defaultdict
 from datetime import UTC, datetime, timedelta
+from pathlib import Path
 
-from github_utils import REPO_NAME, run_gh
+from github_utils import (
+    LAST_PAGE_REGEX,
+    NEXT_LINK_REGEX,
+    RELEASE_DOWNLOAD_URL,
+    REPO_NAME,
+    RateLimiter,
+    RateLimitError,
+    get_client,
+)
+from metrics import count, stage, write_summary
 
 SOURCE_REPO = "keiyoushi/extensions-source"
 PUBLISH_WORKFLOW = "build_push.yml"
 PUBLISH_JOB = "Publish extension repo"
 MIN_PUBLISH_AGE = timedelta(hours=1)
 POLL_INTERVAL = 60
-DELETE_INTERVAL = 1
+PAGE_SIZE = 100
+# The release listing embeds at most this many assets per release.
+EMBEDDED_ASSET_LIMIT = 100
+REFERENCED_RELEASES_CACHE = (
+    Path.home() / ".cache" / "keiyoushi" / "referenced-releases.json"
+)
+FETCH_CONCURRENCY = 8
+DELETE_CONCURRENCY = 4
+MAX_DELETE_BACKOFF = 60
+# Saved plans are only resumed while they're fresh; later publishes may reference new assets.
+MAX_PLAN_AGE = timedelta(hours=12)
 
 
 def get_json(endpoint: str):
-    return json.loads(run_gh("api", endpoint))
+    return get_client().get(endpoint)
 
 
 def get_pages(endpoint: str) -> list[dict]:
-    items = []
-    page = 1
-    separator = "&" if "?" in endpoint else "?"
-    while True:
-        batch = get_json(f"{endpoint}{separator}per_page=100&page={page}")
-        items.extend(batch)
-        if len(batch) < 100:
-            return items
-        page += 1
+    return get_client().get_pages(endpoint)
 
 
 def get_workflow_runs() -> list[dict]:
+    # Runs are listed newest first by creation, so re-runs of older runs need a wide page.
     return get_json(
-        f"repos/{SOURCE_REPO}/actions/workflows/{PUBLISH_WORKFLOW}/runs?per_page=20"
+        f"repos/{SOURCE_REPO}/actions/workflows/{PUBLISH_WORKFLOW}/runs?per_page=100"
     )["workflow_runs"]
 
 
+# Jobs of a completed run only change when it's re-run, which updates the run too.
+completed_run_jobs: dict[tuple[int, str], list[dict]] = {}
+
+
+def get_run_jobs(run: dict) -> list[dict]:
+    key = (run["id"], run["updated_at"])
+    if key in completed_run_jobs:
+        return completed_run_jobs[key]
+
+    jobs = get_json(f"repos/{SOURCE_REPO}/actions/runs/{run['id']}/jobs?per_page=100")[
+        "jobs"
+    ]
+    if run["status"] == "completed":
+        completed_run_jobs[key] = jobs
+    return jobs
+
+
+def parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
 def get_latest_publish_job(runs: list[dict]) -> dict | None:
-    publish_jobs = []
-    for run in runs:
-        jobs = get_json(
-            f"repos/{SOURCE_REPO}/actions/runs/{run['id']}/jobs?per_page=100"
-        )["jobs"]
-        publish_jobs.extend(
-            job
-            for job in jobs
-            if job["name"] == PUBLISH_JOB and job.get("conclusion") != "skipped"
-        )
+    """
+    returns the publish job that finished last, or one that hasn't finished
+    yet. a re-run keeps its run's created_at, so runs are checked by
+    updated_at: once a run was last updated before the latest publish job
+    completed, neither it nor any older run can hold a later one
+    """
+    latest = None
+    for run in sorted(
+        runs, key=lambda run: parse_time(run["updated_at"]), reverse=True
+    ):
+        if latest and parse_time(run["updated_at"]) < parse_time(
+            latest["completed_at"]
+        ):
+            break
+        for job in get_run_jobs(run):
+            if job["name"] != PUBLISH_JOB or job.get("conclusion") == "skipped":
+                continue
+            if job["status"] != "completed":
+                return job
+            if latest is None or parse_time(job["completed_at"]) > parse_time(
+                latest["completed_at"]
+            ):
+                latest = job
+
+    return latest
 
-    if not publish_jobs:
-        return None
 
-    return max(publish_jobs, key=lambda job: job["completed_at"])
+def wait_for_run(run: dict) -> None:
+    """
+    waits for a run to complete, re-querying only that run. unchanged
+    responses are served from the ETag cache and don't count against the
+    rate limit
+    """
+    while run["status"] != "completed":
+        print(f"CI run {run['id']} is {run['status']}; checking again in 60s")
+        time.sleep(POLL_INTERVAL)
+        run = get_json(f"repos/{SOURCE_REPO}/actions/runs/{run['id']}")
 
 
 def wait_for_publish_window() -> None:
@@ -57,17 +117,19 @@ def wait_for_publish_window() -> None:
         runs = get_workflow_runs()
         active_runs = [run for run in runs if run["status"] != "completed"]
         if active_runs:
-            run = active_runs[0]
-            print(f"CI run {run['id']} is {run['status']}; checking again in 60s")
-            time.sleep(POLL_INTERVAL)
+            wait_for_run(active_runs[0])
             continue
 
         job = get_latest_publish_job(runs)
         if job is None:
             print("No previous publish job found")
             return
+        if job["status"] != "completed":
+            print(f"Publish job {job['id']} is {job['status']}; checking again in 60s")
+            time.sleep(POLL_INTERVAL)
+            continue
 
-        safe_at = datetime.fromisoformat(job["completed_at"]) + MIN_PUBLISH_AGE
+        safe_at = parse_time(job["completed_at"]) + MIN_PUBLISH_AGE
         remaining = (safe_at - datetime.now(UTC)).total_seconds()
         if remaining <= 0:
             return
@@ -80,13 +142,9 @@ def wait_for_publish_window() -> None:
 
 
 def get_referenced_assets() -> set[str]:
-    index = json.loads(
-        run_gh(
-            "api",
-            "--header",
-            "Accept: application/vnd.github.raw+json",
-            f"repos/{REPO_NAME}/contents/index.json?ref=repo",
-        )
+    index = get_client().get(
+        f"repos/{REPO_NAME}/contents/index.json?ref=repo",
+        headers={"Accept": "application/vnd.github.raw+json"},
     )
     return {
         extension["resources"][field]
@@ -95,46 +153,373 @@ def get_referenced_assets() -> set[str]:
     }
 
 
-def cleanup_releases(referenced: set[str]) -> tuple[int, int]:
-    deleted_assets = 0
-    deleted_releases = 0
-    releases = get_pages(f"repos/{REPO_NAME}/releases")
+async def fetch_pages(endpoint: str, semaphore: asyncio.Semaphore) -> list[dict]:
+    """
+    fetches the first page, then every remaining page concurrently using the
+    last page number from the Link header
+    """
+    client = get_client()
+    separator = "&" if "?" in endpoint else "?"
+    url = f"{endpoint}{separator}per_page={PAGE_SIZE}"
+    async with semaphore:
+        response = await asyncio.to_thread(client.request, "GET", url)
+
+    items = response.json()
+    match = LAST_PAGE_REGEX.search(response.headers.get("link", ""))
+    if match:
+
+        async def fetch(page: int) -> list[dict]:
+            async with semaphore:
+                return await asyncio.to_thread(client.get, f"{url}&page={page}")
+
+        for batch in await asyncio.gather(
+            *(fetch(page) for page in range(2, int(match.group("page")) + 1))
+        ):
+            items.extend(batch)
+    return items
+
+
+def get_release_fingerprints(referenced: set[str]) -> dict[str, str]:
+    """
+    returns tag -> hash of the referenced asset urls in that release
+    """
+    urls_by_tag = defaultdict(list)
+    for url in referenced:
+        if url.startswith(RELEASE_DOWNLOAD_URL):
+            tag = url.removeprefix(RELEASE_DOWNLOAD_URL).split("/", 1)[0]
+            urls_by_tag[tag].append(url)
+    return {
+        tag: hashlib.sha256("\n".join(sorted(urls)).encode()).hexdigest()
+        for tag, urls in urls_by_tag.items()
+    }
+
+
+def load_referenced_releases(path: Path) -> dict[str, dict]:
+    try:
+        with path.open(encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_referenced_releases(path: Path, releases: dict[str, dict]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(releases, f, indent=2, sort_keys=True)
+
+
+async def has_asset_count(
+    release_id: int, asset_count: int, semaphore: asyncio.Semaphore
+) -> bool:
+    """
+    checks that a release still has exactly asset_count assets by fetching
+    only the asset page where that count ends
+    """
+    page = asset_count // PAGE_SIZE + 1
+    async with semaphore:
+        response = await asyncio.to_thread(
+            get_client().request,
+            "GET",
+            f"repos/{REPO_NAME}/releases/{release_id}/assets"
+            f"?per_page={PAGE_SIZE}&page={page}",
+        )
+    return len(response.json()) == asset_count % PAGE_SIZE and not (
+        NEXT_LINK_REGEX.search(response.headers.get("link", ""))
+    )
+
+
+async def fetch_inventory(skip: dict[int, int] | None = None) -> list[dict]:
+    """
+    returns every release with all of its assets. assets come from the
+    release listing; only releases whose embedded assets may be truncated
+    get their asset pages fetched, concurrently. truncated releases in
+    `skip` (id -> asset count when last seen fully referenced) are left out
+    when one page shows they still have that many assets, since a top-up
+    by the publisher changes the count
+    """
+    skip = skip or {}
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    releases = await fetch_pages(f"repos/{REPO_NAME}/releases", semaphore)
+    truncated = [
+        release
+        for release in releases
+        if len(release.get("assets", [])) >= EMBEDDED_ASSET_LIMIT
+    ]
+    candidates = [release for release in truncated if release["id"] in skip]
+    same_counts = await asyncio.gather(
+        *(
+            has_asset_count(release["id"], skip[release["id"]], semaphore)
+            for release in candidates
+        )
+    )
+    unchanged = {
+        release["id"]
+        for release, same_count in zip(candidates, same_counts)
+        if same_count
+    }
+    releases = [release for release in releases if release["id"] not in unchanged]
+    truncated = [release for release in truncated if release["id"] not in unchanged]
+    assets = await asyncio.gather(
+        *(
+            fetch_pages(f"repos/{REPO_NAME}/releases/{release['id']}/assets", semaphore)
+            for release in truncated
+        )
+    )
+    for release, release_assets in zip(truncated, assets):
+        release["assets"] = release_assets
+    print(
+        f"Listed {len(releases)} releases ({len(unchanged)} skipped as fully referenced), "
+        f"{len(truncated)} needed asset pagination"
+    )
+    return releases
+
 
+def create_plan(
+    releases: list[dict],
+    referenced: set[str],
+    referenced_releases: dict[str, dict] | None = None,
+) -> dict:
+    """
+    returns the assets and releases to delete. releases without any
+    referenced asset are deleted whole, which also removes their assets.
+    releases that turn out fully referenced are recorded in
+    referenced_releases with their tag, fingerprint and asset count
+    """
+    fingerprints = get_release_fingerprints(referenced)
+    plan = {"created_at": datetime.now(UTC).isoformat(), "assets": [], "releases": []}
     for release in releases:
-        assets = get_pages(f"repos/{REPO_NAME}/releases/{release['id']}/assets")
-        remaining = len(assets)
-        for asset in assets:
-            if asset["browser_download_url"] in referenced:
-                continue
+        unreferenced = [
+            asset
+            for asset in release["assets"]
+            if asset["browser_download_url"] not in referenced
+        ]
+        if release["assets"] and not unreferenced:
+            if referenced_releases is not None:
+                referenced_releases[str(release["id"])] = {
+                    "tag": release["tag_name"],
+                    "fingerprint": fingerprints.get(release["tag_name"]),
+                    "assets": len(release["assets"]),
+                }
+            continue
 
-            print(f"Deleting {release['tag_name']}/{asset['name']}")
-            run_gh(
-                "api",
-                "--method",
-                "DELETE",
-                f"repos/{REPO_NAME}/releases/assets/{asset['id']}",
+        if len(unreferenced) == len(release["assets"]):
+            plan["releases"].append(
+                {
+                    "id": release["id"],
+                    "tag": release["tag_name"],
+                    "assets": len(unreferenced),
+                }
             )
-            deleted_assets += 1
-            remaining -= 1
-            time.sleep(DELETE_INTERVAL)
-
-        if remaining == 0:
-            print(f"Deleting empty release {release['tag_name']}")
-            run_gh(
-                "api",
-                "--method",
-                "DELETE",
-                f"repos/{REPO_NAME}/releases/{release['id']}",
-            )
-            deleted_releases += 1
+            continue
+
+        plan["assets"].extend(
+            {"id": asset["id"], "tag": release["tag_name"], "name": asset["name"]}
+            for asset in unreferenced
+        )
+    return plan
+
+
+def load_plan(path: Path) -> tuple[dict | None, set[str]]:
+    """
+    returns a saved plan and the deletions already done for it, or no plan
+    if it's too old to trust
+    """
+    with path.open(encoding="utf-8") as f:
+        plan = json.load(f)
+    created_at = datetime.fromisoformat(plan["created_at"])
+    if datetime.now(UTC) - created_at > MAX_PLAN_AGE:
+        print(f"Ignoring {path} created at {created_at.isoformat()}")
+        return None, set()
+    done_path = path.with_suffix(".done")
+    done = set(done_path.read_text("utf-8").split()) if done_path.exists() else set()
+    return plan, done
+
+
+def save_plan(path: Path, plan: dict) -> None:
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=2)
+    path.with_suffix(".done").unlink(missing_ok=True)
+
+
+class Backoff:
+    """
+    Shared pause for the delete workers: every rate limit doubles the delay
+    and pauses all workers, and every success halves it again.
+    """
+
+    def __init__(self):
+        self.delay = 0.0
+        self.resume_at = 0.0
+
+    async def wait(self) -> None:
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(max(self.resume_at - loop.time(), 0) + self.delay)
+
+    def failed(self, retry_after: float) -> None:
+        self.delay = min(max(self.delay * 2, 1.0), MAX_DELETE_BACKOFF)
+        resume_at = asyncio.get_running_loop().time() + retry_after
+        self.resume_at = max(self.resume_at, resume_at)
+        count("delete backoff seconds", retry_after)
+        print(f"Rate limited; pausing deletes for {retry_after:.0f}s")
+
+    def succeeded(self) -> None:
+        self.delay /= 2
+        if self.delay < 0.1:
+            self.delay = 0.0
 
-    return deleted_assets, deleted_releases
+
+async def execute_plan(
+    plan: dict, done: set[str], done_path: Path | None
+) -> tuple[int, int]:
+    client = get_client()
+    # Deletes aren't held to the content pacing uploads are. Backoff reacts to GitHub's
+    # secondary limits instead, and the limiter only spreads out the primary limit.
+    rate_limiter = RateLimiter(per_minute=None)
+    backoff = Backoff()
+    queue = asyncio.Queue()
+    counts = {"asset": 0, "release": 0}
+    failures = []
+    done_file = done_path.open("a", encoding="utf-8") if done_path else None
+
+    def delete(kind: str, item: dict) -> None:
+        rate_limiter.acquire()
+        endpoint = (
+            f"repos/{REPO_NAME}/releases/assets/{item['id']}"
+            if kind == "asset"
+            else f"repos/{REPO_NAME}/releases/{item['id']}"
+        )
+        # 404 means a previous, interrupted run already deleted it.
+        client.request("DELETE", endpoint, success_statuses=(404,), attempts=1)
+
+    async def worker() -> None:
+        while True:
+            kind, item = await queue.get()
+            try:
+                await backoff.wait()
+                await asyncio.to_thread(delete, kind, item)
+            except RateLimitError as e:
+                backoff.failed(e.retry_after)
+                queue.put_nowait((kind, item))
+                continue
+            except Exception as e:
+                print(f"Failed to delete {kind} {item['tag']}: {e}")
+                failures.append(item)
+                continue
+            finally:
+                queue.task_done()
+
+            backoff.succeeded()
+            if kind == "asset":
+                counts["asset"] += 1
+                print(f"Deleted {item['tag']}/{item['name']}")
+            else:
+                counts["asset"] += item["assets"]
+                counts["release"] += 1
+                print(f"Deleted release {item['tag']} ({item['assets']} assets)")
+            if done_file:
+                done_file.write(f"{kind}:{item['id']}\n")
+                done_file.flush()
+
+    for kind, items in (("asset", plan["assets"]), ("release", plan["releases"])):
+        for item in items:
+            if f"{kind}:{item['id']}" not in done:
+                queue.put_nowait((kind, item))
+
+    workers = [asyncio.create_task(worker()) for _ in range(DELETE_CONCURRENCY)]
+    try:
+        await queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        if done_file:
+            done_file.close()
+
+    if failures:
+        raise RuntimeError(f"{len(failures)} deletions failed; re-run to resume")
+    return counts["asset"], counts["release"]
 
 
 def main() -> None:
-    wait_for_publish_window()
-    referenced_assets = get_referenced_assets()
-    asset_count, release_count = cleanup_releases(referenced_assets)
+    parser = argparse.ArgumentParser(description="Delete unreferenced release assets")
+    parser.add_argument(
+        "--plan",
+        type=Path,
+        help="save the deletion plan here, or resume it if it already exists",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only create and print the plan"
+    )
+    parser.add_argument(
+        "--referenced-cache",
+        type=Path,
+        default=REFERENCED_RELEASES_CACHE,
+        help="releases known to be fully referenced, skipped while the index agrees",
+    )
+    args = parser.parse_args()
+
+    plan = None
+    done = set()
+    if args.plan and args.plan.exists() and not args.dry_run:
+        plan, done = load_plan(args.plan)
+        if plan is not None:
+            print(f"Resuming {args.plan} ({len(done)} deletions already done)")
+
+    if plan is None:
+        with stage("wait for publish window"):
+            wait_for_publish_window()
+        with stage("load index"):
+            referenced_assets = get_referenced_assets()
+        fingerprints = get_release_fingerprints(referenced_assets)
+        # A release stays fully referenced as long as the index references the same
+        # assets in it and nothing was added to it, so it can be skipped without
+        # listing all of its assets.
+        referenced_releases = {
+            release_id: release
+            for release_id, release in load_referenced_releases(
+                args.referenced_cache
+            ).items()
+            if fingerprints.get(release["tag"]) == release["fingerprint"]
+            and "assets" in release
+        }
+        with stage("inventory"):
+            releases = asyncio.run(
+                fetch_inventory(
+                    {
+                        int(release_id): release["assets"]
+                        for release_id, release in referenced_releases.items()
+                    }
+                )
+            )
+        # Listed releases are re-checked below, so only the skipped ones keep their entry.
+        listed = {str(release["id"]) for release in releases}
+        referenced_releases = {
+            release_id: release
+            for release_id, release in referenced_releases.items()
+            if release_id not in listed
+        }
+        with stage("plan"):
+            plan = create_plan(releases, referenced_assets, referenced_releases)
+        save_referenced_releases(args.referenced_cache, referenced_releases)
+        if args.plan:
+            save_plan(args.plan, plan)
+
+    total_assets = len(plan["assets"]) + sum(r["assets"] for r in plan["releases"])
+    print(
+        f"Plan: delete {len(plan['assets'])} assets and {len(plan['releases'])} "
+        f"releases ({total_assets} assets in total)"
+    )
+    if args.dry_run:
+        return
+
+    done_path = args.plan.with_suffix(".done") if args.plan else None
+    with stage("delete"):
+        asset_count, release_count = asyncio.run(execute_plan(plan, done, done_path))
+    # A finished plan must not be resumed by the next run.
+    if args.plan:
+        args.plan.unlink(missing_ok=True)
+        done_path.unlink(missing_ok=True)
+    count("assets deleted", asset_count)
+    count("releases deleted", release_count)
     summary = (
         f"Deleted {asset_count} unreferenced assets and {release_count} empty releases"
     )
@@ -142,4 +527,7 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        write_summary("Release cleanup")
@@ -0,0 +1,366 @@
+"""
+In-memory stand-in for the parts of the GitHub REST API the publish and
+cleanup scripts use, so they can be run offline:
+
+    python fake_github.py --state state.json --port 8000 &
+    GITHUB_API_URL=http://localhost:8000 GITHUB_UPLOADS_URL=http://localhost:8000/uploads \
+        python cleanup-releases.py
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import re
+import signal
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+RATE_LIMIT = 5000
+EMBEDDED_ASSET_LIMIT = 100
+ROUTES = []
+
+
+def route(method: str, pattern: str):
+    def decorator(handler):
+        ROUTES.append((method, re.compile(f"^{pattern}$"), handler))
+        return handler
+
+    return decorator
+
+
+class FakeGitHub:
+    """
+    Holds releases, assets, repository contents and workflow runs for one or
+    more repos, seeded from a state dict:
+
+        {"releases": {"owner/repo": [{"tag_name": ..., "draft": ..., "assets": [...]}]},
+         "contents": {"owner/repo": {"index.json": "..."}},
+         "workflow_runs": {"owner/repo": [{"id": ..., "status": ..., "jobs": [...]}]}}
+    """
+
+    def __init__(self, state: dict | None = None, base_url: str = ""):
+        state = state or {}
+        self.base_url = base_url
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.releases: dict[str, list[dict]] = {}
+        self.contents: dict[str, dict[str, str]] = state.get("contents", {})
+        self.workflow_runs: dict[str, list[dict]] = state.get("workflow_runs", {})
+        self.calls = Counter()
+        self.remaining = RATE_LIMIT
+        self.reset = int(time.time()) + 3600
+
+        for repo, releases in state.get("releases", {}).items():
+            for release in releases:
+                created = self.add_release(repo, release)
+                for asset in release.get("assets", []):
+                    self.add_asset(
+                        repo,
+                        created,
+                        asset["name"],
+                        asset.get("size", 0),
+                        asset.get("digest"),
+                    )
+
+    def new_id(self) -> int:
+        self.next_id += 1
+        return self.next_id
+
+    def add_release(self, repo: str, release: dict) -> dict:
+        release_id = release.get("id") or self.new_id()
+        created = {
+            "id": release_id,
+            "tag_name": release["tag_name"],
+            "name": release.get("name", release["tag_name"]),
+            "body": release.get("body", ""),
+            "draft": release.get("draft", False),
+            "upload_url": f"{self.base_url}/uploads/repos/{repo}/releases/{release_id}/assets{{?name,label}}",
+            "assets": [],
+        }
+        # New releases are listed first, like on GitHub.
+        self.releases.setdefault(repo, []).insert(0, created)
+        return created
+
+    def add_asset(
+        self, repo: str, release: dict, name: str, size: int, digest: str | None
+    ) -> dict:
+        asset = {
+            "id": self.new_id(),
+            "name": name,
+            "size": size,
+            "digest": digest,
+            "browser_download_url": f"https://github.com/{repo}/releases/download/{release['tag_name']}/{name}",
+        }
+        release["assets"].append(asset)
+        return asset
+
+    def find_release(self, repo: str, release_id: int) -> dict | None:
+        return next(
+            (r for r in self.releases.get(repo, []) if r["id"] == release_id), None
+        )
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    github: FakeGitHub
+
+    def log_message(self, format, *args):
+        pass
+
+    def dispatch(self, method: str):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        for route_method, pattern, handler in ROUTES:
+            if route_method == method and (match := pattern.match(url.path)):
+                with self.github.lock:
+                    self.github.calls[f"{method} {pattern.pattern}"] += 1
+                    self.github.remaining = max(self.github.remaining - 1, 0)
+                    status, payload, headers = handler(
+                        self.github, params, body, **match.groupdict()
+                    )
+                self.respond(status, payload, headers)
+                return
+        self.respond(404, {"message": "Not Found"})
+
+    def respond(self, status: int, payload, headers: dict[str, str] | None = None):
+        headers = dict(headers or {})
+        if isinstance(payload, (bytes, str)):
+            data = payload.encode() if isinstance(payload, str) else payload
+        else:
+            data = json.dumps(payload).encode() if payload is not None else b""
+
+        etag = f'"{hashlib.sha1(data).hexdigest()}"'
+        if self.command == "GET" and status == 200:
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                status, data = 304, b""
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-RateLimit-Limit", str(RATE_LIMIT))
+        self.send_header("X-RateLimit-Remaining", str(self.github.remaining))
+        self.send_header("X-RateLimit-Reset", str(self.github.reset))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PATCH(self):
+        self.dispatch("PATCH")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+
+def paginate(github: FakeGitHub, path: str, items: list, params: dict):
+    per_page = int(params.get("per_page", 30))
+    page = int(params.get("page", 1))
+    last = max(math.ceil(len(items) / per_page), 1)
+    url = f"{github.base_url}{path}?per_page={per_page}"
+    links = []
+    if page < last:
+        links.append(f'<{url}&page={page + 1}>; rel="next"')
+        links.append(f'<{url}&page={last}>; rel="last"')
+    headers = {"Link": ", ".join(links)} if links else {}
+    return 200, items[(page - 1) * per_page : page * per_page], headers
+
+
+REPO = r"/repos/(?P<repo>[^/]+/[^/]+)"
+
+
+@route("GET", "/rate_limit")
+def get_rate_limit(github, params, body):
+    core = {"limit": RATE_LIMIT, "remaining": github.remaining, "reset": github.reset}
+    return 200, {"resources": {"core": core}}, {}
+
+
+@route("GET", f"{REPO}/releases")
+def list_releases(github, params, body, repo):
+    # Like GitHub, the listing only embeds the first page of each release's assets.
+    releases = [
+        {**release, "assets": release["assets"][:EMBEDDED_ASSET_LIMIT]}
+        for release in github.releases.get(repo, [])
+    ]
+    return paginate(github, f"/repos/{repo}/releases", releases, params)
+
+
+@route("POST", f"{REPO}/releases")
+def create_release(github, params, body, repo):
+    return 201, github.add_release(repo, json.loads(body)), {}
+
+
+@route("GET", f"{REPO}/releases/tags/(?P<tag>[^/]+)")
+def get_release_by_tag(github, params, body, repo, tag):
+    release = next(
+        (
+            r
+            for r in github.releases.get(repo, [])
+            if r["tag_name"] == tag and not r["draft"]
+        ),
+        None,
+    )
+    return (200, release, {}) if release else (404, {"message": "Not Found"}, {})
+
+
+@route("PATCH", f"{REPO}/releases/(?P<release_id>\\d+)")
+def update_release(github, params, body, repo, release_id):
+    release = github.find_release(repo, int(release_id))
+    if release is None:
+        return 404, {"message": "Not Found"}, {}
+    release.update(json.loads(body))
+    return 200, release, {}
+
+
+@route("DELETE", f"{REPO}/releases/(?P<release_id>\\d+)")
+def delete_release(github, params, body, repo, release_id):
+    release = github.find_release(repo, int(release_id))
+    if release is None:
+        return 404, {"message": "Not Found"}, {}
+    github.releases[repo].remove(release)
+    return 204, None, {}
+
+
+@route("GET", f"{REPO}/releases/(?P<release_id>\\d+)/assets")
+def list_assets(github, params, body, repo, release_id):
+    release = github.find_release(repo, int(release_id))
+    if release is None:
+        return 404, {"message": "Not Found"}, {}
+    return paginate(
+        github, f"/repos/{repo}/releases/{release_id}/assets", release["assets"], params
+    )
+
+
+@route("POST", f"/uploads{REPO}/releases/(?P<release_id>\\d+)/assets")
+def upload_asset(github, params, body, repo, release_id):
+    release = github.find_release(repo, int(release_id))
+    if release is None:
+        return 404, {"message": "Not Found"}, {}
+    if any(asset["name"] == params["name"] for asset in release["assets"]):
+        return (
+            422,
+            {"message": "Validation Failed", "errors": [{"code": "already_exists"}]},
+            {},
+        )
+    digest = f"sha256:{hashlib.sha256(body).hexdigest()}"
+    return 201, github.add_asset(repo, release, params["name"], len(body), digest), {}
+
+
+@route("DELETE", f"{REPO}/releases/assets/(?P<asset_id>\\d+)")
+def delete_asset(github, params, body, repo, asset_id):
+    for release in github.releases.get(repo, []):
+        for asset in release["assets"]:
+            if asset["id"] == int(asset_id):
+                release["assets"].remove(asset)
+                return 204, None, {}
+    return 404, {"message": "Not Found"}, {}
+
+
+@route("GET", f"{REPO}/contents/(?P<path>.+)")
+def get_contents(github, params, body, repo, path):
+    content = github.contents.get(repo, {}).get(path)
+    return (
+        (200, content, {})
+        if content is not None
+        else (404, {"message": "Not Found"}, {})
+    )
+
+
+@route("GET", f"{REPO}/actions/workflows/(?P<workflow>[^/]+)/runs")
+def list_workflow_runs(github, params, body, repo, workflow):
+    runs = [
+        {key: value for key, value in run.items() if key != "jobs"}
+        for run in github.workflow_runs.get(repo, [])
+    ]
+    return 200, {"workflow_runs": runs[: int(params.get("per_page", 30))]}, {}
+
+
+@route("GET", f"{REPO}/actions/runs/(?P<run_id>\\d+)")
+def get_workflow_run(github, params, body, repo, run_id):
+    run = next(
+        (r for r in github.workflow_runs.get(repo, []) if r["id"] == int(run_id)), None
+    )
+    if run is None:
+        return 404, {"message": "Not Found"}, {}
+    return 200, {key: value for key, value in run.items() if key != "jobs"}, {}
+
+
+@route("GET", f"{REPO}/actions/runs/(?P<run_id>\\d+)/jobs")
+def list_jobs(github, params, body, repo, run_id):
+    run = next(
+        (r for r in github.workflow_runs.get(repo, []) if r["id"] == int(run_id)), None
+    )
+    if run is None:
+        return 404, {"message": "Not Found"}, {}
+    return 200, {"jobs": run.get("jobs", [])}, {}
+
+
+def serve(
+    state: dict | None = None, port: int = 0
+) -> tuple[ThreadingHTTPServer, FakeGitHub]:
+    """
+    starts the fake server on a background thread and returns it with its
+    state; port 0 picks a free port (see server.server_address)
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    github = FakeGitHub(state, f"http://127.0.0.1:{server.server_address[1]}")
+    server.RequestHandlerClass = type("BoundHandler", (Handler,), {"github": github})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, github
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a local fake GitHub REST API")
+    parser.add_argument(
+        "--state", help="JSON file with the initial releases, contents and runs"
+    )
+    parser.add_argument("--save", help="write the final state here on shutdown")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    state = None
+    if args.state:
+        with open(args.state, encoding="utf-8") as f:
+            state = json.load(f)
+
+    server, github = serve(state, args.port)
+    print(f"Fake GitHub API listening on {github.base_url}", flush=True)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    stop.wait()
+    server.shutdown()
+
+    print(json.dumps(dict(github.calls), indent=2))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "releases": {
+                        repo: releases[::-1]
+                        for repo, releases in github.releases.items()
+                    },
+                    "contents": github.contents,
+                    "workflow_runs": github.workflow_runs,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,39 @@
-import itertools
 import json
+import math
 import os
 import re
 import subprocess
 import sys
 from pathlib import Path
 
+from build_scheduler import (
+    TIMINGS_PATH,
+    balance_chunks,
+    batch_chunks,
+    estimate_costs,
+    get_chunk_count,
+    get_chunk_projects,
+    get_chunk_size,
+    group_by_affinity,
+    load_timings,
+)
+from change_rules import (
+    FULL,
+    LIB_VERSION,
+    LINT,
+    PUBLISH,
+    classify_file,
+    get_changed_lib_versions,
+    get_lib_versions,
+)
+from input_hashes import compute_input_hashes, load_published_hashes
+from metrics import count, stage, write_summary
+from module_graph import build_graph, list_tree, resolve_dependents
+
 EXTENSION_REGEX = re.compile(r"^src/(?P<lang>\w+)/(?P<extension>\w+)")
 MULTISRC_LIB_REGEX = re.compile(r"^lib-multisrc/(?P<multisrc>\w+)")
 LIB_REGEX = re.compile(r"^lib/(?P<lib>\w+)")
 MODULE_REGEX = re.compile(r"^:src:(?P<lang>\w+):(?P<extension>\w+)$")
-CORE_FILES_REGEX = re.compile(
-    r"^(common/|compiler/|core/|gradle/|build\.gradle\.kts|gradle\.properties|settings\.gradle\.kts|.github/scripts)"
-)
 
 def run_command(command: str) -> str:
     result = subprocess.run(command, capture_output=True, text=True, shell=True)
@@ -22,172 +43,137 @@ def run_command(command: str) -> str:
     return result.stdout.strip()
 
 
-def resolve_dependent_libs(libs: set[str]) -> set[str]:
-    """
-    returns all libs which depend on any of the passed libs (/lib),
-    recursively resolving transitive dependencies
-    """
-    if not libs:
-        return set()
-
-    all_dependent_libs = set()
-    to_process = set(libs)
-
-    while to_process:
-        current_libs = to_process
-        to_process = set()
-
-        lib_dependency = re.compile(
-            rf"project\([\"']:(?:lib):({'|'.join(map(re.escape, current_libs))})[\"']\)"
-        )
-
-        for lib in Path("lib").iterdir():
-            if lib.name in all_dependent_libs or lib.name in libs:
-                continue
-
-            build_file = lib / "build.gradle.kts"
-            if not build_file.is_file():
-                continue
-
-            content = build_file.read_text("utf-8")
-
-            if lib_dependency.search(content):
-                all_dependent_libs.add(lib.name)
-                to_process.add(lib.name)
-
-    return all_dependent_libs
-
-
-def resolve_multisrc_lib(libs: set[str]) -> set[str]:
-    """
-    returns all multisrc which depend on any of the
-    passed libs (/lib)
-    """
-    if not libs:
-        return set()
-
-    lib_dependency = re.compile(
-        rf"project\([\"']:(?:lib):({'|'.join(map(re.escape, libs))})[\"']\)"
-    )
-
-    multisrcs = set()
-
-    for multisrc in Path("lib-multisrc").iterdir():
-        build_file = multisrc / "build.gradle.kts"
-        if not build_file.is_file():
-            continue
-
-        content = build_file.read_text("utf-8")
-
-        if (lib_dependency.search(content)):
-            multisrcs.add(multisrc.name)
-
-    return multisrcs
-
-def resolve_ext(multisrcs: set[str], libs: set[str]) -> set[tuple[str, str]]:
+def get_changed_files(ref: str, head: str | None) -> list[str]:
     """
-    returns all extensions which depend on any of the
-    passed multisrcs or libs
+    returns the files changed between ref and the working tree, or between
+    ref and head straight from git objects when head is passed
     """
-    if not multisrcs and not libs:
-        return set()
-
-    multisrc_pattern = '|'.join(map(re.escape, multisrcs)) if multisrcs else None
-    lib_pattern = '|'.join(map(re.escape, libs)) if libs else None
-
-    patterns = []
-    if multisrc_pattern:
-        patterns.append(rf"theme\s*=\s*['\"]({multisrc_pattern})['\"]")
-    if lib_pattern:
-        patterns.append(rf"project\([\"']:(?:lib):({lib_pattern})[\"']\)")
+    if head is not None:
+        diff_output = run_command(f"git diff-tree -r -z --name-only {ref} {head}")
+        return [file for file in diff_output.split("\0") if file]
 
-    regex = re.compile('|'.join(patterns))
-
-    extensions = set()
-
-    for lang in Path("src").iterdir():
-        for extension in lang.iterdir():
-            build_file = extension / "build.gradle.kts"
-            if not build_file.is_file():
-                continue
-
-            content = build_file.read_text("utf-8")
-
-            if regex.search(content):
-                extensions.add((lang.name, extension.name))
-
-    return extensions
-
-def get_module_list(ref: str) -> tuple[list[str], list[str], list[str]]:
     diff_output = run_command(f"git diff --name-status {ref}").splitlines()
 
-    changed_files = [
+    return [
         file
         for line in diff_output
         for file in line.split("\t", 2)[1:]
     ]
 
+
+def get_module_list(
+    ref: str, head: str | None = None
+) -> tuple[list[str], list[str], list[str], bool]:
+    """
+    returns the modules to build, the extensions to delete, the shared
+    modules to lint, and whether the repo has to be republished even
+    without any of them. changes outside modules are weighed by
+    change_rules
+    """
+    changed_files = get_changed_files(ref, head)
+
+    def is_dir(*parts: str) -> bool:
+        if head is not None:
+            return "/".join(parts) in list_tree(head)[0]
+        return Path(*parts).is_dir()
+
     modules = set()
     multisrcs = set()
     libs = set()
     deleted = set()
-    core_files_changed = False
+    impacts = set()
 
     for file in map(lambda x: Path(x).as_posix(), changed_files):
-        if CORE_FILES_REGEX.search(file):
-            core_files_changed = True
+        if impact := classify_file(file):
+            impacts.add(impact)
 
         elif match := EXTENSION_REGEX.search(file):
             lang = match.group("lang")
             extension = match.group("extension")
-            if Path("src", lang, extension).is_dir():
+            if is_dir("src", lang, extension):
                 modules.add(f':src:{lang}:{extension}')
             deleted.add(f"{lang}.{extension}")
 
         elif match := MULTISRC_LIB_REGEX.search(file):
             multisrc = match.group("multisrc")
-            if Path("lib-multisrc", multisrc).is_dir():
+            if is_dir("lib-multisrc", multisrc):
                 multisrcs.add(multisrc)
 
         elif match := LIB_REGEX.search(file):
             lib = match.group("lib")
-            if Path("lib", lib).is_dir():
+            if is_dir("lib", lib):
                 libs.add(lib)
 
-    if core_files_changed:
-        (all_modules, all_deleted) = get_all_modules()
+    lib_versions = set()
+    if LIB_VERSION in impacts:
+        changed_versions = get_changed_lib_versions(ref, head)
+        if changed_versions is None:
+            impacts.add(FULL)
+        else:
+            lib_versions = changed_versions
+    print(f"Changes outside modules: {sorted(impacts) or 'none'}")
+    publish = PUBLISH in impacts
+
+    if FULL in impacts:
+        (all_modules, all_deleted) = get_all_modules(head)
 
         # update existing set so we include deleted extensions
         modules.update(all_modules)
         deleted.update(all_deleted)
 
-        return sorted(modules), sorted(deleted), get_all_lint_modules()
+        return sorted(modules), sorted(deleted), get_all_lint_modules(head), publish
 
-    # Resolve libs that depend on the changed libs (recursively)
-    libs.update(
-        resolve_dependent_libs(libs)
-    )
-
-    # Resolve multisrcs that depend on the changed libs
-    multisrcs.update(
-        resolve_multisrc_lib(libs)
-    )
-
-    # Resolve extensions that depend on the changed multisrcs or libs
-    extensions = resolve_ext(multisrcs, libs)
-    modules.update([f":src:{lang}:{extension}" for lang, extension in extensions])
-    deleted.update([f"{lang}.{extension}" for lang, extension in extensions])
+    if lib_versions:
+        for module, version in get_lib_versions(head).items():
+            if version not in lib_versions:
+                continue
+            if match := MODULE_REGEX.search(module):
+                modules.add(module)
+                deleted.add(f"{match.group('lang')}.{match.group('extension')}")
+            elif module.startswith(":lib-multisrc:"):
+                multisrcs.add(module.removeprefix(":lib-multisrc:"))
+
+    # Resolve libs, multisrcs and extensions that depend on the changed
+    # libs or multisrcs (recursively)
+    if libs or multisrcs:
+        dependents = resolve_dependents(
+            build_graph(ref=head),
+            {
+                *(f":lib:{lib}" for lib in libs),
+                *(f":lib-multisrc:{multisrc}" for multisrc in multisrcs),
+            },
+        )
+        for module in dependents:
+            if match := MODULE_REGEX.search(module):
+                modules.add(module)
+                deleted.add(f"{match.group('lang')}.{match.group('extension')}")
+            elif module.startswith(":lib-multisrc:"):
+                multisrcs.add(module.removeprefix(":lib-multisrc:"))
+            elif module.startswith(":lib:"):
+                libs.add(module.removeprefix(":lib:"))
 
     lint_modules = {
         *(f":lib:{lib}" for lib in libs),
         *(f":lib-multisrc:{multisrc}" for multisrc in multisrcs),
     }
 
-    return sorted(modules), sorted(deleted), sorted(lint_modules)
+    if LINT in impacts:
+        return sorted(modules), sorted(deleted), get_all_lint_modules(head), publish
+
+    return sorted(modules), sorted(deleted), sorted(lint_modules), publish
 
-def get_all_modules() -> tuple[list[str], list[str]]:
+def get_all_modules(head: str | None = None) -> tuple[list[str], list[str]]:
     modules = []
     deleted = []
+    if head is not None:
+        directories, _ = list_tree(head)
+        for directory in sorted(directories):
+            if directory.startswith("src/"):
+                _, lang, extension = directory.split("/")
+                modules.append(f":src:{lang}:{extension}")
+                deleted.append(f"{lang}.{extension}")
+        return modules, deleted
+
     for lang in Path("src").iterdir():
         for extension in lang.iterdir():
             modules.append(f":src:{lang.name}:{extension.name}")
@@ -195,8 +181,15 @@ def get_all_modules() -> tuple[list[str], list[str]]:
     return modules, deleted
 
 
-def get_all_lint_modules() -> list[str]:
+def get_all_lint_modules(head: str | None = None) -> list[str]:
     modules = [":core"]
+    if head is not None:
+        _, build_files = list_tree(head)
+        modules.extend(
+            module for module in build_files if not module.startswith(":src:")
+        )
+        return sorted(modules)
+
     modules.extend(
         f":{directory}:{module.name}"
         for directory in ("lib", "lib-multisrc")
@@ -206,28 +199,108 @@ def get_all_lint_modules() -> list[str]:
     return sorted(modules)
 
 
-def create_matrix(modules: list[str]) -> dict:
+def drop_unchanged_modules(
+    modules: list[str], deleted: list[str], ref: str
+) -> tuple[list[str], list[str]]:
+    """
+    drops extensions whose input hash matches the one recorded when they were
+    last published, from both the modules to build and the modules to delete
+    """
+    published = load_published_hashes()
+    hashes = compute_input_hashes(modules, ref)
+    unchanged = {
+        module
+        for module, input_hash in hashes.items()
+        if published.get(module) == input_hash
+    }
+    unchanged_names = {
+        f"{match.group('lang')}.{match.group('extension')}"
+        for module in unchanged
+        if (match := MODULE_REGEX.search(module))
+    }
+    print(f"Skipping {len(unchanged)} modules with unchanged inputs")
+    count("modules skipped as unchanged", len(unchanged))
+    return (
+        [module for module in modules if module not in unchanged],
+        [name for name in deleted if name not in unchanged_names],
+    )
+
+
+def create_matrix(modules: list[str], head: str | None = None) -> dict:
+    """
+    splits modules into build chunks. CI_CHUNK_STRATEGY=cost balances chunks
+    by estimated build time and CI_CHUNK_STRATEGY=theme additionally keeps
+    modules sharing a theme or libs together (see build_scheduler),
+    otherwise modules are batched alphabetically. CI_CHUNK_COUNT targets a
+    number of chunks instead of CI_CHUNK_SIZE. each chunk also lists the
+    projects gradle has to include to build it
+    """
+    # nothing to build is common once unchanged modules are skipped
+    if not modules:
+        return {"chunk": []}
+
+    graph = build_graph(ref=head)
+    chunk_count = get_chunk_count(len(modules))
+    chunk_size = None if os.getenv("CI_CHUNK_COUNT") else get_chunk_size()
+    strategy = os.getenv("CI_CHUNK_STRATEGY")
+    if strategy == "cost":
+        chunks = balance_chunks(
+            estimate_costs(modules, load_timings(TIMINGS_PATH), head),
+            chunk_count,
+            chunk_size,
+        )
+    elif strategy == "theme":
+        chunks = group_by_affinity(
+            estimate_costs(modules, load_timings(TIMINGS_PATH), head),
+            graph,
+            chunk_count,
+            chunk_size,
+        )
+    elif os.getenv("CI_CHUNK_COUNT"):
+        chunks = batch_chunks(modules, math.ceil(len(modules) / chunk_count))
+    else:
+        chunks = batch_chunks(modules, get_chunk_size())
+
     return {
         "chunk": [
-            {"number": i + 1, "modules": chunk}
-            for i, chunk in enumerate(itertools.batched(
-                modules,
-                int(os.getenv("CI_CHUNK_SIZE", 65))
-            ))
+            {
+                "number": i + 1,
+                "modules": chunk,
+                "projects": get_chunk_projects(chunk, graph),
+            }
+            for i, chunk in enumerate(chunks)
         ]
     }
 
 
 def main() -> None:
-    _, ref = sys.argv
-    modules, deleted, lint_modules = get_module_list(ref)
-
-    matrix = create_matrix(modules)
+    # passing a head ref computes everything from git objects, which works
+    # on shallow, sparse or blobless checkouts
+    ref = sys.argv[1]
+    head = sys.argv[2] if len(sys.argv) > 2 else None
+    with stage("module list"):
+        modules, deleted, lint_modules, publish = get_module_list(ref, head)
+
+    # Build avoidance: only used when publishing, pull requests always build what they touch.
+    if os.getenv("CI_SKIP_UNCHANGED") == "true":
+        with stage("input hashes"):
+            modules, deleted = drop_unchanged_modules(modules, deleted, head or "HEAD")
+
+    with stage("matrix"):
+        matrix = create_matrix(modules, head)
+        upstream = [
+            len(chunk["projects"]) - len(chunk["modules"]) for chunk in matrix["chunk"]
+        ]
+    count("modules to build", len(modules))
+    count("chunks", len(matrix["chunk"]))
+    count("upstream compilations", sum(upstream))
 
     print(
         f"Module chunks to build:\n{json.dumps(matrix, indent=2)}\n\n"
+        f"Upstream modules compiled per chunk: {upstream} (total {sum(upstream)})\n\n"
         f"Modules to lint:\n{json.dumps(lint_modules, indent=2)}\n\n"
-        f"Module to delete:\n{json.dumps(deleted, indent=2)}"
+        f"Module to delete:\n{json.dumps(deleted, indent=2)}\n\n"
+        f"Publish without builds: {publish}"
     )
 
     if os.getenv("CI") == "true":
@@ -235,6 +308,10 @@ def main() -> None:
             out_file.write(f"matrix={json.dumps(matrix)}\n")
             out_file.write(f"lint_modules={json.dumps(lint_modules)}\n")
             out_file.write(f"delete={json.dumps(deleted)}\n")
+            out_file.write(f"publish={json.dumps(publish)}\n")
 
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    finally:
+        write_summary("Build matrix")
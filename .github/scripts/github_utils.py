@@ -1,50 +1,325 @@
-import subprocess
+import http.client
+import json
+import os
+import re
+import threading
 import time
+from pathlib import Path
+from urllib.parse import urlencode, urljoin, urlsplit
+
+from metrics import count
 
 REPO_NAME = "keiyoushi/extensions"
+RELEASE_DOWNLOAD_URL = f"https://github.com/{REPO_NAME}/releases/download/"
 RETRY_ATTEMPTS = 4
 RETRY_BASE_DELAY = 60
 
+# GitHub's per-minute secondary limit on content-creating requests (uploads, deletes,
+# releases). Anything stricter GitHub enforces is answered with 403/429 and backed off from.
+CONTENT_REQUESTS_PER_MINUTE = 80
+# Core requests kept in reserve for the rest of the job once the primary limit runs low.
+RATE_LIMIT_RESERVE = 100
+RATE_LIMIT_REFRESH_INTERVAL = 60
 
-def run_gh(*args: str, success_errors: tuple[str, ...] = ()) -> str:
-    attempt = 1
-    delay = RETRY_BASE_DELAY
-    while True:
-        result = subprocess.run(
-            ["gh", *args],
-            capture_output=True,
-            encoding="utf-8",
-            check=False,
-        )
-        if result.returncode == 0:
-            return result.stdout.strip()
-
-        error = result.stderr.lower()
-        if any(success_error in error for success_error in success_errors):
-            return result.stdout.strip()
-
-        if "secondary rate limit" in error and attempt < RETRY_ATTEMPTS:
-            retry_delay = delay
-            delay *= 2
-        elif "api rate limit exceeded" in error and attempt < RETRY_ATTEMPTS:
-            rate_limit = subprocess.run(
-                ["gh", "api", "rate_limit", "--jq", ".resources.core.reset"],
-                capture_output=True,
-                encoding="utf-8",
-                check=False,
+API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+UPLOADS_URL = os.getenv("GITHUB_UPLOADS_URL", "https://uploads.github.com")
+API_VERSION = "2022-11-28"
+REQUEST_TIMEOUT = 300
+NEXT_LINK_REGEX = re.compile(r'<(?P<url>[^>]+)>;\s*rel="next"')
+LAST_PAGE_REGEX = re.compile(r'<[^>]*[?&]page=(?P<page>\d+)[^>]*>;\s*rel="last"')
+
+
+class RateLimitError(RuntimeError):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GitHubResponse:
+    def __init__(self, status: int, headers: dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+
+class GitHubClient:
+    """
+    In-process REST client: one keep-alive connection per host and thread,
+    conditional GETs through cached ETags, and retries with backoff on
+    secondary limits or until the reset when the primary limit runs out.
+    """
+
+    def __init__(
+        self,
+        token: str | None = None,
+        api_url: str = API_URL,
+        uploads_url: str = UPLOADS_URL,
+    ):
+        self.token = token or os.getenv("GH_TOKEN") or os.getenv("GITHUB_TOKEN")
+        self.api_url = api_url.rstrip("/") + "/"
+        self.uploads_url = uploads_url.rstrip("/") + "/"
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.etags: dict[str, tuple[str, bytes]] = {}
+        self.rate_limit: dict | None = None
+        # Until when GitHub asked to hold off, shared with RateLimiter so every thread waits.
+        self.retry_at = 0.0
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        connections = self.local.__dict__.setdefault("connections", {})
+        connection = connections.get((scheme, netloc))
+        if connection is None:
+            connection_class = (
+                http.client.HTTPSConnection
+                if scheme == "https"
+                else http.client.HTTPConnection
             )
-            retry_delay = RETRY_BASE_DELAY
-            if rate_limit.returncode == 0:
+            connection = connection_class(netloc, timeout=REQUEST_TIMEOUT)
+            connections[(scheme, netloc)] = connection
+        return connection
+
+    def _send(
+        self, method: str, url: str, body, headers: dict[str, str]
+    ) -> GitHubResponse:
+        parts = urlsplit(url)
+        target = parts.path + (f"?{parts.query}" if parts.query else "")
+        for reconnect in (False, True):
+            connection = self._connection(parts.scheme, parts.netloc)
+            try:
+                if hasattr(body, "seek"):
+                    body.seek(0)
+                connection.request(method, target, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                # The server may have dropped an idle keep-alive connection; retry once.
+                connection.close()
+                if reconnect:
+                    raise
+                continue
+            return GitHubResponse(
+                response.status,
+                {key.lower(): value for key, value in response.getheaders()},
+                data,
+            )
+
+    def _record_rate_limit(self, headers: dict[str, str]) -> None:
+        if "x-ratelimit-remaining" not in headers:
+            return
+        with self.lock:
+            self.rate_limit = {
+                "limit": int(headers.get("x-ratelimit-limit", 0)),
+                "remaining": int(headers["x-ratelimit-remaining"]),
+                "reset": int(headers.get("x-ratelimit-reset", 0)),
+            }
+
+    def request(
+        self,
+        method: str,
+        endpoint: str,
+        *,
+        params: dict | None = None,
+        json_body=None,
+        body=None,
+        headers: dict[str, str] | None = None,
+        success_statuses: tuple[int, ...] = (),
+        attempts: int = RETRY_ATTEMPTS,
+    ) -> GitHubResponse:
+        """
+        sends a request, retrying rate limited responses up to `attempts`
+        times before raising RateLimitError
+        """
+        url = urljoin(self.api_url, endpoint)
+        if params:
+            url += ("&" if "?" in url else "?") + urlencode(params)
+
+        request_headers = {
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": API_VERSION,
+            "User-Agent": "keiyoushi-extensions-scripts",
+        }
+        if self.token:
+            request_headers["Authorization"] = f"Bearer {self.token}"
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            request_headers["Content-Type"] = "application/json"
+        request_headers.update(headers or {})
+
+        cached = self.etags.get(url) if method == "GET" else None
+        if cached:
+            request_headers["If-None-Match"] = cached[0]
+
+        attempt = 1
+        delay = RETRY_BASE_DELAY
+        while True:
+            count("api calls")
+            response = self._send(method, url, body, request_headers)
+            self._record_rate_limit(response.headers)
+
+            if response.status == 304 and cached:
+                count("api calls not modified")
+                response.status = 200
+                response.body = cached[1]
+                return response
+            if response.status < 400 or response.status in success_statuses:
+                if method == "GET" and "etag" in response.headers:
+                    self.etags[url] = (response.headers["etag"], response.body)
+                return response
+
+            error = response.body.decode("utf-8", "replace")
+            lowered = error.lower()
+            if response.status not in (403, 429):
+                raise RuntimeError(f"{method} {url} failed: {response.status} {error}")
+            if "retry-after" in response.headers or "secondary rate limit" in lowered:
+                retry_delay = int(response.headers.get("retry-after", delay))
+                delay *= 2
+            elif response.headers.get("x-ratelimit-remaining") == "0":
                 retry_delay = max(
-                    int(rate_limit.stdout.strip()) - int(time.time()) + 10,
+                    int(response.headers.get("x-ratelimit-reset", 0))
+                    - int(time.time())
+                    + 10,
                     RETRY_BASE_DELAY,
                 )
-        else:
-            raise RuntimeError(f"gh {' '.join(args)} failed: {result.stderr.strip()}")
+            else:
+                raise RuntimeError(f"{method} {url} failed: {response.status} {error}")
 
-        print(
-            f"GitHub rate limit hit; retrying in {retry_delay}s "
-            f"(attempt {attempt}/{RETRY_ATTEMPTS})"
+            self.retry_at = max(self.retry_at, time.time() + retry_delay)
+            if attempt >= attempts:
+                raise RateLimitError(
+                    f"{method} {url} failed: {response.status} {error}", retry_delay
+                )
+
+            print(
+                f"GitHub rate limit hit; retrying in {retry_delay}s "
+                f"(attempt {attempt}/{attempts})"
+            )
+            count("retries")
+            count("retry backoff seconds", retry_delay)
+            time.sleep(retry_delay)
+            attempt += 1
+
+    def get(self, endpoint: str, **kwargs):
+        return self.request("GET", endpoint, **kwargs).json()
+
+    def get_pages(self, endpoint: str, per_page: int = 100) -> list:
+        """
+        returns every item of a paginated endpoint, following the Link header
+        """
+        items = []
+        url = endpoint + ("&" if "?" in endpoint else "?") + f"per_page={per_page}"
+        while url:
+            response = self.request("GET", url)
+            items.extend(response.json())
+            match = NEXT_LINK_REGEX.search(response.headers.get("link", ""))
+            url = match.group("url") if match else None
+        return items
+
+    def upload_asset(self, release: dict, file: Path) -> dict:
+        """
+        uploads a file to a release, streaming it from disk
+        """
+        upload_url = release.get("upload_url", "").split("{", 1)[0] or urljoin(
+            self.uploads_url, f"repos/{REPO_NAME}/releases/{release['id']}/assets"
         )
-        time.sleep(retry_delay)
-        attempt += 1
+        with file.open("rb") as f:
+            return self.request(
+                "POST",
+                upload_url,
+                params={"name": file.name},
+                body=f,
+                headers={
+                    "Content-Type": "application/octet-stream",
+                    "Content-Length": str(file.stat().st_size),
+                },
+            ).json()
+
+
+_client: GitHubClient | None = None
+
+
+def get_client() -> GitHubClient:
+    global _client
+    if _client is None:
+        _client = GitHubClient()
+    return _client
+
+
+def get_rate_limit() -> dict:
+    """
+    returns the core rate limit (limit, remaining, reset), taken from the
+    last response's headers when there is one. querying it doesn't count
+    against the limit itself
+    """
+    client = get_client()
+    if client.rate_limit is not None and client.rate_limit["reset"] > time.time():
+        return client.rate_limit
+    return client.get("rate_limit")["resources"]["core"]
+
+
+class RateLimiter:
+    """
+    Paces requests across threads. Content-creating requests are kept under
+    GitHub's per-minute secondary limit with a sliding window, every thread
+    holds off while GitHub's last retry-after or rate limit reset is pending,
+    and once the primary limit drops to RATE_LIMIT_RESERVE the remaining
+    requests are spread evenly until the limit resets. Without per_minute,
+    only GitHub's answers and the primary limit pace requests.
+    """
+
+    def __init__(self, per_minute: int | None = CONTENT_REQUESTS_PER_MINUTE):
+        self.per_minute = per_minute
+        self.lock = threading.Lock()
+        # Send times of the last minute's requests, including ones still waiting to go out.
+        self.window: list[float] = []
+        self.remaining: int | None = None
+        self.reset = 0.0
+        self.checked_at = 0.0
+
+    def _refresh(self) -> None:
+        now = time.time()
+        if now - self.checked_at < RATE_LIMIT_REFRESH_INTERVAL and now < self.reset:
+            return
+        rate_limit = get_rate_limit()
+        self.remaining = rate_limit["remaining"]
+        self.reset = float(rate_limit["reset"])
+        self.checked_at = now
+
+    def acquire(self, requests: int = 1) -> None:
+        """
+        blocks until `requests` more content-creating requests may be sent
+        """
+        if self.per_minute:
+            requests = min(requests, self.per_minute)
+        # The slot is reserved under the lock, but waited for outside of it so other
+        # threads can reserve the following slots meanwhile.
+        with self.lock:
+            self._refresh()
+            now = time.time()
+            delay = max(get_client().retry_at - now, 0.0)
+            if (
+                self.remaining is not None
+                and self.remaining < RATE_LIMIT_RESERVE + requests
+            ):
+                delay = max(
+                    delay,
+                    max(self.reset - now, 0) * requests / max(self.remaining, 1),
+                )
+
+            self.window = sorted(sent for sent in self.window if sent > now - 60)
+            recent = [sent for sent in self.window if sent > now + delay - 60]
+            if self.per_minute and len(recent) + requests > self.per_minute:
+                oldest = recent[len(recent) + requests - self.per_minute - 1]
+                delay = max(delay, oldest + 60 - now)
+
+            self.window.extend([now + delay] * requests)
+            if self.remaining is not None:
+                self.remaining -= requests
+
+        if delay > 0:
+            if delay >= 1:
+                print(f"Pacing GitHub requests; waiting {delay:.0f}s")
+            count("pacing seconds", delay)
+            time.sleep(delay)
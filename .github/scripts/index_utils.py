@@ -0,0 +1,466 @@
+import argparse
+import gzip
+import hashlib
+import html
+import json
+import tempfile
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from pathlib import Path
+
+import index_pb2
+from google.protobuf import json_format
+
+# Optional codecs for the precompressed index variants.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from compression.zstd import compress as zstd_compress
+    from compression.zstd import decompress as zstd_decompress
+except ImportError:
+    try:
+        import zstandard
+    except ImportError:
+        zstd_compress = zstd_decompress = None
+    else:
+
+        def zstd_compress(data: bytes, level: int) -> bytes:
+            return zstandard.ZstdCompressor(level=level).compress(data)
+
+        def zstd_decompress(data: bytes) -> bytes:
+            return zstandard.ZstdDecompressor().decompress(data)
+
+
+SHARD_DIR = "shards"
+DELTA_DIR = "deltas"
+MAX_DELTAS = 20
+
+
+def get_module(package_name: str) -> str:
+    """
+    returns the `lang.extension` module a package name was built from
+    """
+    return ".".join(package_name.rsplit(".", 2)[-2:])
+
+
+def drop_modules(
+    release_assets: dict[str, dict], modules: Iterable[str]
+) -> dict[str, dict]:
+    """
+    returns release-assets.json entries whose package isn't in one of
+    the passed modules
+    """
+    modules = set(modules)
+    return {
+        package_name: assets
+        for package_name, assets in release_assets.items()
+        if get_module(package_name) not in modules
+    }
+
+
+def merge_extensions(
+    published: Iterable[index_pb2.Extension],
+    built: Iterable[index_pb2.Extension],
+    modules: Iterable[str],
+) -> list[index_pb2.Extension]:
+    """
+    returns the published extensions minus the deleted or rebuilt modules,
+    plus the freshly built ones, sorted by package name
+    """
+    modules = set(modules)
+    extensions = [
+        ext for ext in published if get_module(ext.packageName) not in modules
+    ]
+    extensions.extend(built)
+    extensions.sort(key=lambda ext: ext.packageName)
+    return extensions
+
+
+def load_index(repo_dir: Path) -> index_pb2.Index:
+    """
+    loads the published index, preferring the binary index.pb over
+    re-parsing index.json
+    """
+    pb_path = repo_dir / "index.pb"
+    if pb_path.exists():
+        return index_pb2.Index.FromString(gzip.decompress(pb_path.read_bytes()))
+
+    with (repo_dir / "index.json").open(encoding="utf-8") as f:
+        return json_format.Parse(f.read(), index_pb2.Index())
+
+
+def serialize_json(index: index_pb2.Index) -> str:
+    return json_format.MessageToJson(
+        index,
+        always_print_fields_with_no_presence=False,
+        preserving_proto_field_name=True,
+    )
+
+
+def serialize_pb(index: index_pb2.Index) -> bytes:
+    return gzip.compress(index.SerializeToString(deterministic=True), mtime=0)
+
+
+def serialize_html(index: index_pb2.Index) -> str:
+    lines = [
+        '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="UTF-8">\n<title>apks</title>\n</head>\n<body>\n<pre>\n'
+    ]
+    for ext in index.extensionList.extensions:
+        apk_escaped = html.escape(ext.resources.apkUrl)
+        name_escaped = html.escape(f"Tachiyomi: {ext.name}")
+        lines.append(f'<a href="{apk_escaped}">{name_escaped}</a>\n')
+    lines.append("</pre>\n</body>\n</html>\n")
+    return "".join(lines)
+
+
+def write_index(index: index_pb2.Index, repo_dir: Path) -> None:
+    """
+    writes index.json, index.pb and index.html from the same message
+    """
+    (repo_dir / "index.json").write_text(serialize_json(index), encoding="utf-8")
+    (repo_dir / "index.pb").write_bytes(serialize_pb(index))
+    (repo_dir / "index.html").write_text(serialize_html(index), encoding="utf-8")
+
+
+def get_shard(ext: index_pb2.Extension, sharding: str) -> str:
+    """
+    returns the shard an extension goes into: its module's language for
+    `lang`, or a stable bucket of its package name for `hash:<buckets>`
+    """
+    if sharding == "lang":
+        return get_module(ext.packageName).split(".", 1)[0]
+
+    buckets = int(sharding.removeprefix("hash:"))
+    digest = hashlib.sha256(ext.packageName.encode()).digest()
+    return f"{int.from_bytes(digest[:4], 'big') % buckets:02d}"
+
+
+def write_shards(
+    index: index_pb2.Index, repo_dir: Path, sharding: str, base_url: str
+) -> dict[str, str]:
+    """
+    splits the extension list into content-addressed shards/<shard>-<hash>.pb
+    files and writes a small index-<shard>.json/.pb root per shard that
+    references its list through extensionListUrl. unchanged shards keep
+    their file name, so clients and caches only re-fetch the ones that
+    changed. the shards of the previous roots are kept for one more cycle,
+    so roots still cached somewhere don't point at deleted files. returns
+    shard -> list url
+    """
+    previous = set()
+    for path in repo_dir.glob("index-*.json"):
+        root = json.loads(path.read_text("utf-8"))
+        if url := root.get("extensionListUrl"):
+            previous.add(url.rsplit("/", 1)[1])
+
+    shards = defaultdict(list)
+    for ext in index.extensionList.extensions:
+        shards[get_shard(ext, sharding)].append(ext)
+
+    shard_dir = repo_dir / SHARD_DIR
+    shard_dir.mkdir(exist_ok=True)
+    urls = {}
+    for shard, extensions in sorted(shards.items()):
+        data = index_pb2.ExtensionList(extensions=extensions).SerializeToString(
+            deterministic=True
+        )
+        name = f"{shard}-{hashlib.sha256(data).hexdigest()[:16]}.pb"
+        path = shard_dir / name
+        if not path.exists():
+            path.write_bytes(gzip.compress(data, mtime=0))
+        urls[shard] = f"{base_url}/{SHARD_DIR}/{name}"
+
+        root = index_pb2.Index()
+        root.CopyFrom(index)
+        root.extensionListUrl = urls[shard]
+        (repo_dir / f"index-{shard}.json").write_text(
+            serialize_json(root), encoding="utf-8"
+        )
+        (repo_dir / f"index-{shard}.pb").write_bytes(serialize_pb(root))
+
+    referenced = {url.rsplit("/", 1)[1] for url in urls.values()} | previous
+    for path in shard_dir.iterdir():
+        if path.name not in referenced:
+            path.unlink()
+    for path in repo_dir.glob("index-*.*"):
+        if path.stem.removeprefix("index-") not in shards:
+            path.unlink()
+
+    return urls
+
+
+def get_index_hash(index: index_pb2.Index) -> str:
+    """
+    returns the sha256 of the index as published in index.pb
+    """
+    return hashlib.sha256(serialize_pb(index)).hexdigest()
+
+
+def diff_indexes(old: index_pb2.Index, new: index_pb2.Index) -> dict:
+    """
+    returns a delta that turns the old index into the new one: the
+    index metadata plus the added, updated and removed extensions
+    """
+    old_extensions = {ext.packageName: ext for ext in old.extensionList.extensions}
+    new_extensions = {ext.packageName: ext for ext in new.extensionList.extensions}
+    metadata = index_pb2.Index()
+    metadata.CopyFrom(new)
+    metadata.ClearField("extensions")
+
+    def to_dict(ext: index_pb2.Extension) -> dict:
+        return json_format.MessageToDict(ext, preserving_proto_field_name=True)
+
+    return {
+        "base": get_index_hash(old),
+        "target": get_index_hash(new),
+        "metadata": json_format.MessageToDict(
+            metadata, preserving_proto_field_name=True
+        ),
+        "added": [
+            to_dict(ext)
+            for name, ext in new_extensions.items()
+            if name not in old_extensions
+        ],
+        "updated": [
+            to_dict(ext)
+            for name, ext in new_extensions.items()
+            if name in old_extensions and old_extensions[name] != ext
+        ],
+        "removed": sorted(old_extensions.keys() - new_extensions.keys()),
+    }
+
+
+def apply_delta(index: index_pb2.Index, delta: dict) -> index_pb2.Index:
+    """
+    returns the index a delta produces from its base index
+    """
+    extensions = {ext.packageName: ext for ext in index.extensionList.extensions}
+    for name in delta["removed"]:
+        del extensions[name]
+    for data in (*delta["added"], *delta["updated"]):
+        ext = json_format.ParseDict(data, index_pb2.Extension())
+        extensions[ext.packageName] = ext
+
+    result = json_format.ParseDict(delta["metadata"], index_pb2.Index())
+    result.extensionList.extensions.extend(
+        extensions[name] for name in sorted(extensions)
+    )
+    return result
+
+
+def write_delta(
+    old: index_pb2.Index, new: index_pb2.Index, repo_dir: Path
+) -> dict | None:
+    """
+    writes deltas/<base hash>.json turning the previously published index
+    into the new one, and keeps the MAX_DELTAS most recent deltas listed
+    in deltas/index.json. clients holding the index.pb with a listed hash
+    can follow the chain up to `latest` instead of downloading the full
+    index. returns the delta, or nothing if the index didn't change
+    """
+    delta = diff_indexes(old, new)
+    if delta["base"] == delta["target"]:
+        return None
+
+    # Round-trip check: the published chain must reproduce the new index exactly.
+    if get_index_hash(apply_delta(old, delta)) != delta["target"]:
+        raise RuntimeError("index delta doesn't reproduce the new index")
+
+    delta_dir = repo_dir / DELTA_DIR
+    delta_dir.mkdir(exist_ok=True)
+    manifest_path = delta_dir / "index.json"
+    manifest = (
+        json.loads(manifest_path.read_text("utf-8"))
+        if manifest_path.exists()
+        else {"deltas": []}
+    )
+
+    with (delta_dir / f"{delta['base']}.json").open("w", encoding="utf-8") as f:
+        json.dump(delta, f, separators=(",", ":"), sort_keys=True)
+
+    deltas = [d for d in manifest["deltas"] if d["base"] != delta["base"]]
+    deltas.append(
+        {
+            "base": delta["base"],
+            "target": delta["target"],
+            "file": f"{delta['base']}.json",
+        }
+    )
+    deltas = deltas[-MAX_DELTAS:]
+    manifest = {"latest": delta["target"], "deltas": deltas}
+    with manifest_path.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+
+    kept = {d["file"] for d in deltas} | {manifest_path.name}
+    for path in delta_dir.iterdir():
+        if path.name not in kept:
+            path.unlink()
+
+    return delta
+
+
+def get_codecs() -> dict[str, tuple[str, Callable, Callable]]:
+    """
+    returns codec -> (file suffix, compress, decompress) for every codec
+    available here. all of them produce byte-identical output across runs
+    """
+    codecs = {
+        "gzip": (
+            "gz",
+            lambda data: gzip.compress(data, compresslevel=9, mtime=0),
+            gzip.decompress,
+        )
+    }
+    if brotli is not None:
+        codecs["brotli"] = (
+            "br",
+            lambda data: brotli.compress(data, quality=11),
+            brotli.decompress,
+        )
+    if zstd_compress is not None:
+        codecs["zstd"] = (
+            "zst",
+            lambda data: zstd_compress(data, level=19),
+            zstd_decompress,
+        )
+    return codecs
+
+
+def write_compressed_variants(
+    index: index_pb2.Index, repo_dir: Path, codecs: Iterable[str]
+) -> list[tuple[str, int, float, float]]:
+    """
+    writes index.json.<suffix> and index.bin.<suffix> (the raw protobuf
+    message) for each requested codec, and returns (file, size,
+    compress seconds, decompress seconds) for each written variant
+    """
+    available = get_codecs()
+    payloads = {
+        "index.json": serialize_json(index).encode(),
+        "index.bin": index.SerializeToString(deterministic=True),
+    }
+    report = []
+    for codec in codecs:
+        if codec not in available:
+            print(f"Skipping {codec} index variants: codec isn't installed")
+            continue
+        suffix, compress, decompress = available[codec]
+        for name, payload in payloads.items():
+            start = time.perf_counter()
+            data = compress(payload)
+            compressed_at = time.perf_counter()
+            decompress(data)
+            decompressed_at = time.perf_counter()
+            (repo_dir / f"{name}.{suffix}").write_bytes(data)
+            report.append(
+                (
+                    f"{name}.{suffix}",
+                    len(data),
+                    compressed_at - start,
+                    decompressed_at - compressed_at,
+                )
+            )
+    return report
+
+
+def print_compression_report(report: list[tuple[str, int, float, float]]) -> None:
+    print(f"  {'variant':<18} {'bytes':>10} {'compress':>10} {'decompress':>11}")
+    for name, size, compress_time, decompress_time in report:
+        print(
+            f"  {name:<18} {size:>10} {compress_time * 1000:>8.1f}ms "
+            f"{decompress_time * 1000:>9.1f}ms"
+        )
+
+
+def create_synthetic_index(extension_count: int) -> index_pb2.Index:
+    base_url = "https://github.com/keiyoushi/extensions/releases/download/abcdef0"
+    return index_pb2.Index(
+        name="Keiyoushi",
+        extensionList=index_pb2.ExtensionList(
+            extensions=[
+                index_pb2.Extension(
+                    name=f"Extension {i}",
+                    packageName=f"eu.kanade.tachiyomi.extension.en.ext{i}",
+                    resources=index_pb2.Resources(
+                        apkUrl=f"{base_url}/tachiyomi-en.ext{i}-v1.4.{i}.apk",
+                        jarUrl=f"{base_url}/tachiyomi-en.ext{i}-v1.4.{i}.jar",
+                        iconUrl=f"https://cdn.example/src/en/ext{i}/ic_launcher.png",
+                    ),
+                    extensionLib="1.4",
+                    versionCode=i,
+                    versionName=f"1.4.{i}",
+                    contentWarning=index_pb2.CONTENT_WARNING_SAFE,
+                    sources=[
+                        index_pb2.Source(
+                            id=1_000_000 + i * 10 + j,
+                            name=f"Extension {i}",
+                            language=["en", "fr", "ja"][j],
+                            homeUrl=f"https://ext{i}.example",
+                        )
+                        for j in range(1 + i % 3)
+                    ],
+                )
+                for i in range(extension_count)
+            ]
+        ),
+    )
+
+
+def benchmark(extension_count: int, rounds: int, codecs: list[str]) -> None:
+    """
+    times loading and serializing a synthetic index through both encodings,
+    and reports the requested compressed variants
+    """
+    index = create_synthetic_index(extension_count)
+    json_data = serialize_json(index)
+    pb_data = serialize_pb(index)
+
+    def measure(name: str, function) -> None:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            function()
+        elapsed = (time.perf_counter() - start) / rounds
+        print(f"  {name:<16} {elapsed * 1000:8.1f} ms")
+
+    print(
+        f"{extension_count} extensions: index.json {len(json_data)} bytes, "
+        f"index.pb {len(pb_data)} bytes"
+    )
+    measure("load json", lambda: json_format.Parse(json_data, index_pb2.Index()))
+    measure(
+        "load pb",
+        lambda: index_pb2.Index.FromString(gzip.decompress(pb_data)),
+    )
+    measure("serialize json", lambda: serialize_json(index))
+    measure("serialize pb", lambda: serialize_pb(index))
+    measure("serialize html", lambda: serialize_html(index))
+
+    if codecs:
+        with tempfile.TemporaryDirectory() as directory:
+            print_compression_report(
+                write_compressed_variants(index, Path(directory), codecs)
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark index loading and serialization"
+    )
+    parser.add_argument("--extensions", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument(
+        "--codecs",
+        default=",".join(get_codecs()),
+        help="comma-separated compressed variants to report",
+    )
+    args = parser.parse_args()
+    benchmark(args.extensions, args.rounds, list(filter(None, args.codecs.split(","))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import subprocess
+from collections import defaultdict
+from functools import cache
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from github_utils import REPO_NAME
+from module_graph import MODULE_DIRECTORY_DEPTH, build_graph, resolve_dependencies
+
+# Recorded by the publisher on the repo branch, next to release-assets.json.
+HASHES_FILE = "input-hashes.json"
+PUBLISHED_HASHES_URL = os.getenv(
+    "CI_INPUT_HASHES_URL",
+    f"https://raw.githubusercontent.com/{REPO_NAME}/repo/{HASHES_FILE}",
+)
+# Shared build inputs every module depends on. CI scripts and core's unit tests are left
+# out since they don't end up in the APKs.
+CORE_INPUTS = (
+    "common/",
+    "compiler/",
+    "core/",
+    "gradle/",
+    "build.gradle.kts",
+    "gradle.properties",
+    "settings.gradle.kts",
+)
+CORE_EXCLUDED_INPUTS = ("core/src/test/",)
+
+
+@cache
+def list_blobs(ref: str) -> dict[str, str]:
+    """
+    returns path -> blob id of every tracked file at ref
+    """
+    output = subprocess.run(
+        ["git", "ls-tree", "-r", "-z", ref],
+        capture_output=True,
+        check=True,
+    ).stdout.decode("utf-8")
+    blobs = {}
+    for entry in filter(None, output.split("\0")):
+        info, path = entry.split("\t", 1)
+        blobs[path] = info.split()[2]
+    return blobs
+
+
+def hash_entries(entries: list[tuple[str, str]]) -> str:
+    digest = hashlib.sha256()
+    for name, value in sorted(entries):
+        digest.update(f"{name}\0{value}\n".encode())
+    return digest.hexdigest()
+
+
+def compute_input_hashes(modules: list[str], ref: str = "HEAD") -> dict[str, str]:
+    """
+    returns module -> hash over the blob ids of its own files, of every lib
+    and theme it transitively depends on, and of the shared core inputs.
+    two builds of a module with the same hash compile the same sources
+    """
+    files_by_module = defaultdict(list)
+    core_files = []
+    for path, blob in list_blobs(ref).items():
+        parts = path.split("/")
+        depth = MODULE_DIRECTORY_DEPTH.get(parts[0])
+        if depth and len(parts) > depth:
+            files_by_module[":" + ":".join(parts[:depth])].append((path, blob))
+        elif path.startswith(CORE_INPUTS) and not path.startswith(CORE_EXCLUDED_INPUTS):
+            core_files.append((path, blob))
+
+    core_hash = hash_entries(core_files)
+    module_hashes = {}
+
+    def get_module_hash(module: str) -> str:
+        if module not in module_hashes:
+            module_hashes[module] = hash_entries(files_by_module[module])
+        return module_hashes[module]
+
+    graph = build_graph(ref=ref)
+    return {
+        module: hash_entries(
+            [
+                ("core", core_hash),
+                *(
+                    (dependency, get_module_hash(dependency))
+                    for dependency in {module, *resolve_dependencies(graph, {module})}
+                ),
+            ]
+        )
+        for module in modules
+    }
+
+
+def load_published_hashes(url: str = PUBLISHED_HASHES_URL) -> dict[str, str]:
+    """
+    returns the input hashes of the published builds, or nothing if they
+    can't be fetched, so every module is rebuilt
+    """
+    try:
+        with urlopen(url, timeout=30) as response:
+            return json.load(response)
+    except (URLError, TimeoutError, ValueError) as e:
+        print(f"Couldn't load published input hashes from {url}: {e}")
+        return {}
@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Where to also write the JSON summary, e.g. to upload it as an artifact.
+METRICS_PATH = os.getenv("CI_METRICS_PATH")
+
+_lock = threading.Lock()
+_stages: dict[str, float] = {}
+_counters: Counter[str] = Counter()
+
+
+@contextmanager
+def stage(name: str):
+    """
+    times the enclosed block and adds it to the named stage's duration
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _stages[name] = _stages.get(name, 0.0) + elapsed
+
+
+def count(name: str, value: float = 1) -> None:
+    """
+    adds to a counter, e.g. bytes hashed, API calls or seconds spent backing off
+    """
+    with _lock:
+        _counters[name] += value
+
+
+def reset() -> None:
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+def get_summary() -> dict:
+    with _lock:
+        return {
+            "stages": {name: round(seconds, 3) for name, seconds in _stages.items()},
+            "counters": {
+                name: round(value, 3) if isinstance(value, float) else value
+                for name, value in sorted(_counters.items())
+            },
+        }
+
+
+def write_summary(title: str) -> dict:
+    """
+    prints the collected metrics as JSON, writes them to CI_METRICS_PATH when
+    set, and appends them as tables to the GitHub step summary in Actions
+    """
+    summary = {"title": title, **get_summary()}
+    print(f"Metrics: {json.dumps(summary, sort_keys=True)}")
+
+    if METRICS_PATH:
+        with open(METRICS_PATH, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+    if step_summary := os.getenv("GITHUB_STEP_SUMMARY"):
+        lines = [f"### {title}", "", "| Stage | Seconds |", "| --- | ---: |"]
+        lines += [
+            f"| {name} | {seconds:.2f} |" for name, seconds in summary["stages"].items()
+        ]
+        if summary["counters"]:
+            lines += ["", "| Counter | Value |", "| --- | ---: |"]
+            lines += [
+                f"| {name} | {value} |" for name, value in summary["counters"].items()
+            ]
+        with open(step_summary, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n\n")
+
+    return summary
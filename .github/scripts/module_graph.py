@@ -0,0 +1,389 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from pathlib import Path
+
+from metrics import count
+
+# Bump whenever the parsed fields change so stale caches are rebuilt from scratch.
+CACHE_VERSION = 2
+CACHE_PATH = Path(
+    os.getenv(
+        "MODULE_GRAPH_CACHE",
+        Path.home() / ".cache" / "keiyoushi" / "module-graph.json",
+    )
+)
+
+BUILD_FILE = "build.gradle.kts"
+MODULE_DIRECTORY_DEPTH = {"lib": 2, "lib-multisrc": 2, "src": 3}
+PROJECT_DEPENDENCY_REGEX = re.compile(r"project\([\"'](?P<project>:[\w:-]+)[\"']\)")
+# Below this many files to parse, starting worker processes costs more than it saves.
+PARALLEL_THRESHOLD = 64
+
+# String literals are matched first so `//` inside e.g. a base url isn't taken for a comment.
+COMMENT_REGEX = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/', re.DOTALL)
+STRING_REGEX = re.compile(r'"(?:\\.|[^"\\])*"')
+BLOCK_START_REGEX = re.compile(r"^\s*(?P<block>keiyoushi|source)\s*\{")
+FIELD_REGEX = re.compile(r"^\s*(?P<field>\w+)\s*=\s*(?P<value>.+?)\s*$")
+# listOf("en", "fr").forEach { lang -> ... }, the only loop whose values are known statically.
+LOOP_REGEX = re.compile(
+    r'listOf\((?P<values>(?:\s*"(?:\\.|[^"\\])*"\s*,?)+)\s*\)\s*\.forEach\s*'
+    r"(?P<brace>\{)(?:\s*(?P<param>\w+)\s*->)?"
+)
+BLOCK_FIELDS = {
+    "name",
+    "versionCode",
+    "baseVersionCode",
+    "theme",
+    "libVersion",
+    "contentWarning",
+}
+SOURCE_FIELDS = {"name", "lang", "baseUrl", "id"}
+
+
+def parse_value(value: str) -> str | int | dict:
+    """
+    returns string and int literals as such, ContentWarning.X as X, and any
+    other expression as {"expr": value} so it's never mistaken for a literal
+    """
+    if STRING_REGEX.fullmatch(value):
+        return value[1:-1]
+    if value.isdigit():
+        return int(value)
+    if value.startswith("ContentWarning."):
+        return value.removeprefix("ContentWarning.")
+    return {"expr": value}
+
+
+def expand_source(source: dict, param: str, value: str) -> dict:
+    """
+    returns the source declared in a loop as it is for one of the loop's values
+    """
+    expanded = {}
+    for field, field_value in source.items():
+        if field_value == {"expr": param}:
+            field_value = value
+        elif isinstance(field_value, str):
+            field_value = re.sub(rf"\$(?:{param}\b|\{{{param}\}})", value, field_value)
+        expanded[field] = field_value
+    return expanded
+
+
+def parse_build_file(content: str) -> dict:
+    """
+    returns the fields set in the keiyoushi { } block of a build file, its
+    source { } blocks and its project dependencies, including its multisrc
+    theme. sources declared in a
+    listOf(...).forEach loop are expanded once per value; any other
+    non-literal value is kept as {"expr": ...}
+    """
+    info = {}
+    sources = []
+    block_depth = None
+    source = None
+    source_depth = None
+    depth = 0
+
+    stripped = COMMENT_REGEX.sub(lambda m: m.group(1) or "", content)
+    loops = {
+        stripped.count("\n", 0, match.start("brace")): (
+            match.group("param") or "it",
+            [value[1:-1] for value in STRING_REGEX.findall(match.group("values"))],
+        )
+        for match in LOOP_REGEX.finditer(stripped)
+    }
+    loop = None
+    loop_depth = None
+    loop_sources = []
+
+    for line_number, line in enumerate(stripped.splitlines()):
+        block = BLOCK_START_REGEX.match(line)
+        field = FIELD_REGEX.match(line)
+        if block_depth is None:
+            if block and block.group("block") == "keiyoushi":
+                block_depth = depth + 1
+        elif block and block.group("block") == "source":
+            source = {}
+            source_depth = depth + 1
+            (loop_sources if loop else sources).append(source)
+        elif field and source is not None and depth == source_depth:
+            if field.group("field") in SOURCE_FIELDS:
+                source[field.group("field")] = parse_value(field.group("value"))
+        elif field and depth == block_depth:
+            if field.group("field") in BLOCK_FIELDS:
+                info[field.group("field")] = parse_value(field.group("value"))
+
+        if block_depth is not None and loop is None and line_number in loops:
+            loop = loops[line_number]
+            loop_depth = depth + 1
+
+        bare = STRING_REGEX.sub('""', line)
+        depth += bare.count("{") - bare.count("}")
+        if source is not None and depth < source_depth:
+            source = None
+        if loop is not None and depth < loop_depth:
+            param, values = loop
+            sources.extend(
+                expand_source(loop_source, param, value)
+                for value in values
+                for loop_source in loop_sources
+            )
+            loop = None
+            loop_sources = []
+        if block_depth is not None and depth < block_depth:
+            break
+
+    if sources:
+        info["sources"] = sources
+    dependencies = {
+        match.group("project") for match in PROJECT_DEPENDENCY_REGEX.finditer(content)
+    }
+    if isinstance(info.get("theme"), str):
+        dependencies.add(f":lib-multisrc:{info['theme']}")
+    info["dependencies"] = sorted(dependencies)
+    return info
+
+
+def git_blob_hash(content: bytes) -> str:
+    """
+    hashes content the same way `git hash-object` does, so cache entries
+    can be validated against blob ids on a fresh checkout
+    """
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def iter_build_files(root: Path = Path(".")):
+    """
+    yields (module, build file) for every lib, multisrc theme and extension
+    """
+    for directory in ("lib", "lib-multisrc"):
+        for build_file in sorted(root.glob(f"{directory}/*/{BUILD_FILE}")):
+            yield f":{directory}:{build_file.parent.name}", build_file
+
+    for build_file in sorted(root.glob(f"src/*/*/{BUILD_FILE}")):
+        extension = build_file.parent
+        yield f":src:{extension.parent.name}:{extension.name}", build_file
+
+
+@cache
+def list_tree(ref: str) -> tuple[set[str], dict[str, str]]:
+    """
+    returns the module directories and module -> build file blob id
+    at the given ref, read from git objects without touching the working tree
+    """
+    output = subprocess.run(
+        ["git", "ls-tree", "-r", "-z", ref, "--", *MODULE_DIRECTORY_DEPTH],
+        capture_output=True,
+        check=True,
+    ).stdout.decode("utf-8")
+
+    directories = set()
+    build_files = {}
+    for entry in filter(None, output.split("\0")):
+        info, path = entry.split("\t", 1)
+        parts = path.split("/")
+        depth = MODULE_DIRECTORY_DEPTH[parts[0]]
+        if len(parts) <= depth:
+            continue
+        directories.add("/".join(parts[:depth]))
+        if len(parts) == depth + 1 and parts[-1] == BUILD_FILE:
+            build_files[":" + ":".join(parts[:depth])] = info.split()[2]
+
+    return directories, build_files
+
+
+def read_blobs(blobs: list[str]) -> dict[str, bytes]:
+    """
+    reads all passed blob ids through a single `git cat-file --batch` process
+    """
+    if not blobs:
+        return {}
+
+    output = subprocess.run(
+        ["git", "cat-file", "--batch"],
+        input="".join(f"{blob}\n" for blob in blobs).encode(),
+        capture_output=True,
+        check=True,
+    ).stdout
+
+    contents = {}
+    offset = 0
+    for blob in blobs:
+        header_end = output.index(b"\n", offset)
+        header = output[offset:header_end].split()
+        if header[1] == b"missing":
+            raise FileNotFoundError(f"git object {blob} is missing")
+        size = int(header[2])
+        contents[blob] = output[header_end + 1 : header_end + 1 + size]
+        offset = header_end + 1 + size + 1
+
+    return contents
+
+
+def load_cache(path: Path) -> dict:
+    try:
+        with path.open(encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != CACHE_VERSION:
+        return {}
+    return data.get("modules", {})
+
+
+def save_cache(path: Path, modules: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump({"version": CACHE_VERSION, "modules": modules}, f, sort_keys=True)
+    tmp.replace(path)
+
+
+def parse_build_files(contents: dict[str, str]) -> dict[str, dict]:
+    """
+    returns key -> parsed build file, on a process pool when there are many
+    """
+    if len(contents) < PARALLEL_THRESHOLD:
+        return {key: parse_build_file(content) for key, content in contents.items()}
+    with ProcessPoolExecutor() as executor:
+        return dict(
+            zip(
+                contents,
+                executor.map(parse_build_file, contents.values(), chunksize=32),
+            )
+        )
+
+
+def load_build_files(
+    root: Path = Path("."),
+    cache_path: Path | None = CACHE_PATH,
+    ref: str | None = None,
+) -> dict[str, dict]:
+    """
+    returns module -> parsed build file for every module in the repo.
+
+    entries are reused from the on-disk cache when the build file's
+    mtime and size are unchanged, or when its blob hash still matches;
+    only the remaining files get re-parsed. when a ref is passed, build
+    files are read from git objects at that ref instead of the working tree
+    """
+    cached = load_cache(cache_path) if cache_path else {}
+    modules = {}
+    changed = {}
+
+    if ref is not None:
+        _, build_files = list_tree(ref)
+        missing = sorted(
+            {
+                blob
+                for module, blob in build_files.items()
+                if cached.get(module, {}).get("blob") != blob
+            }
+        )
+        contents = read_blobs(missing)
+        for module, blob in build_files.items():
+            if blob not in contents:
+                modules[module] = cached[module]
+                continue
+
+            modules[module] = {"mtime": None, "size": len(contents[blob]), "blob": blob}
+            changed[module] = contents[blob].decode("utf-8")
+    else:
+        for module, build_file in iter_build_files(root):
+            stat = build_file.stat()
+            entry = cached.get(module)
+            if (
+                entry
+                and entry["mtime"] == stat.st_mtime_ns
+                and entry["size"] == stat.st_size
+            ):
+                modules[module] = entry
+                continue
+
+            content = build_file.read_bytes()
+            modules[module] = {
+                "mtime": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "blob": git_blob_hash(content),
+            }
+            if entry and entry["blob"] == modules[module]["blob"]:
+                modules[module]["info"] = entry["info"]
+            else:
+                changed[module] = content.decode("utf-8")
+
+    for module, info in parse_build_files(changed).items():
+        modules[module]["info"] = info
+
+    print(
+        f"Module graph: {len(modules)} modules, {len(changed)} build files parsed",
+        file=sys.stderr,
+    )
+    count("build files parsed", len(changed))
+
+    if cache_path and modules != cached:
+        save_cache(cache_path, modules)
+
+    return {module: entry["info"] for module, entry in modules.items()}
+
+
+def build_graph(
+    root: Path = Path("."),
+    cache_path: Path | None = CACHE_PATH,
+    ref: str | None = None,
+) -> dict[str, list[str]]:
+    """
+    returns module -> project dependencies for every module in the repo
+    """
+    return {
+        module: info["dependencies"]
+        for module, info in load_build_files(root, cache_path, ref).items()
+    }
+
+
+def reverse_graph(graph: dict[str, list[str]]) -> dict[str, set[str]]:
+    dependents = defaultdict(set)
+    for module, dependencies in graph.items():
+        for dependency in dependencies:
+            dependents[dependency].add(module)
+    return dependents
+
+
+def resolve_dependents(graph: dict[str, list[str]], modules: set[str]) -> set[str]:
+    """
+    returns all modules which depend on any of the passed modules,
+    recursively resolving transitive dependencies
+    """
+    dependents = reverse_graph(graph)
+    seen = set()
+    to_process = list(modules)
+
+    while to_process:
+        for dependent in dependents.get(to_process.pop(), ()):
+            if dependent not in seen and dependent not in modules:
+                seen.add(dependent)
+                to_process.append(dependent)
+
+    return seen
+
+
+def resolve_dependencies(graph: dict[str, list[str]], modules: set[str]) -> set[str]:
+    """
+    returns all modules the passed modules depend on,
+    recursively resolving transitive dependencies
+    """
+    seen = set()
+    to_process = list(modules)
+
+    while to_process:
+        for dependency in graph.get(to_process.pop(), ()):
+            if dependency not in seen:
+                seen.add(dependency)
+                to_process.append(dependency)
+
+    return seen
@@ -0,0 +1,833 @@
+"""
+Builds the extension repo from downloaded build artifacts and uploads the
+changed APKs and JARs as release assets. publish-repo.py is the CI entry
+point; running this module directly benchmarks a publish against a
+synthetic artifacts tree, and --check compares it with a baseline
+recorded on the same kind of machine.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import index_pb2
+from artifact_manifest import (
+    discover_artifacts,
+    hash_files,
+    hash_zip_contents,
+    write_manifest,
+)
+from github_utils import REPO_NAME, RateLimiter, get_client
+from index_utils import (
+    create_synthetic_index,
+    drop_modules,
+    get_module,
+    load_index,
+    merge_extensions,
+    print_compression_report,
+    write_compressed_variants,
+    write_delta,
+    write_index,
+    write_shards,
+)
+from input_hashes import HASHES_FILE
+from metrics import count, get_summary, reset, stage
+
+# Artifacts downloaded from the build jobs: one APK per extension plus the source metadata JSON
+# emitted by each assembleRelease, listed by each job's artifact-manifest.json.
+ARTIFACTS_DIR = Path.home() / "apk-artifacts"
+SOURCE_DIR = Path(__file__).resolve().parents[2]
+
+ICON_FILE = "res/mipmap-xhdpi/ic_launcher.png"
+ICON_BASE_URL = "https://cdn.jsdelivr.net/gh/keiyoushi/extensions-source@main"
+RELEASE_BASE_URL = f"https://github.com/{REPO_NAME}/releases/download"
+INDEX_BASE_URL = f"https://cdn.jsdelivr.net/gh/{REPO_NAME}@repo"
+# Optionally also publish per-shard root indexes next to the full one: "lang" or "hash:<n>".
+INDEX_SHARDING = os.getenv("INDEX_SHARDING")
+# Precompressed index.json/index.bin variants to publish, e.g. "gzip,brotli,zstd".
+INDEX_CODECS = list(filter(None, os.getenv("INDEX_CODECS", "").split(",")))
+# Append ?v=<icon blob id> to icon URLs so CDN and app caches pick up changed icons.
+ICON_VERSIONING = os.getenv("ICON_VERSIONING") == "true"
+
+ASSET_LIMIT = 495  # Actual limit is 1000 but we upload 2 items per extension.
+RELEASE_ASSET_LIMIT = 1000
+UPLOAD_CHUNK_SIZE = 20
+UPLOAD_CONCURRENCY = 3
+UPLOAD_WORKERS = 5
+
+RELEASE_ASSETS_FILE = "release-assets.json"
+
+# Mean benchmark durations recorded with --save-baseline. CI records them on main and
+# checks the scripts' changes against them, so both sides ran on the same kind of runner.
+BENCHMARK_BASELINE_FILE = Path(
+    os.getenv(
+        "PUBLISHER_BENCHMARK_BASELINE",
+        Path.home() / ".cache" / "keiyoushi" / "publisher-benchmark.json",
+    )
+)
+BENCHMARK_TOLERANCE = 1.5
+
+# (extension, apk, jar, apk changed, jar changed) for one freshly built extension.
+Build = tuple[index_pb2.Extension, Path, Path, bool, bool]
+
+
+def load_json(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    with path.open(encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_json(path: Path, data: dict) -> None:
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def list_icons(source_dir: Path = SOURCE_DIR) -> dict[str, str]:
+    """
+    returns icon path -> git blob id for every extension, theme and core icon
+    in the source checkout, read with one `git ls-files` instead of a stat per
+    extension. falls back to scanning the tree (without blob ids) outside git
+    """
+    patterns = [
+        f"src/*/*/{ICON_FILE}",
+        f"lib-multisrc/*/{ICON_FILE}",
+        f"core/src/main/{ICON_FILE}",
+    ]
+    try:
+        output = subprocess.run(
+            ["git", "ls-files", "-s", "-z", "--", *patterns],
+            cwd=source_dir,
+            capture_output=True,
+            check=True,
+        ).stdout.decode("utf-8")
+    except (OSError, subprocess.CalledProcessError):
+        return {
+            path.relative_to(source_dir).as_posix(): ""
+            for pattern in patterns
+            for path in source_dir.glob(pattern)
+        }
+
+    icons = {}
+    for entry in filter(None, output.split("\0")):
+        info, path = entry.split("\t", 1)
+        icons[path] = info.split()[1]
+    return icons
+
+
+def get_icon_url(icons: dict[str, str], module: str, theme: str | None) -> str:
+    candidates = [f"src/{module.replace('.', '/')}/{ICON_FILE}"]
+    if theme:
+        candidates.append(f"lib-multisrc/{theme}/{ICON_FILE}")
+    candidates.append(f"core/src/main/{ICON_FILE}")
+
+    icon = next((path for path in candidates if path in icons), candidates[-1])
+    if ICON_VERSIONING and icons.get(icon):
+        return f"{ICON_BASE_URL}/{icon}?v={icons[icon][:12]}"
+    return f"{ICON_BASE_URL}/{icon}"
+
+
+def create_extension(info: dict, icon_url: str) -> index_pb2.Extension:
+    """
+    builds an index entry from the source-info JSON emitted by an
+    extension's assembleRelease task (see GenerateSourceInfoTask)
+    """
+    return index_pb2.Extension(
+        name=info["name"],
+        packageName=info["packageName"],
+        resources=index_pb2.Resources(iconUrl=icon_url),
+        extensionLib=info["extensionLib"],
+        versionCode=info["versionCode"],
+        versionName=info["versionName"],
+        contentWarning=info["contentWarning"],
+        sources=[
+            index_pb2.Source(
+                id=int(source["id"]),
+                name=source["name"],
+                language=source["lang"],
+                homeUrl=source["baseUrl"],
+                mirrorUrls=source.get("mirrorUrls", []),
+            )
+            for source in info["sources"]
+        ],
+    )
+
+
+def get_published_asset(old_asset: dict | None, asset: dict) -> dict | None:
+    """
+    returns the release-assets.json entry to keep when the built asset needs
+    no upload, or None when it does. a byte-identical asset is unchanged, and
+    so is one with the same name and zip entries as the published one, which
+    keeps the published file and its digest
+    """
+    if not old_asset or old_asset["name"] != asset["name"]:
+        return None
+    if old_asset["sha256"] == asset["sha256"]:
+        return asset
+    if old_asset.get("contentHash") == asset["contentHash"]:
+        count("assets unchanged by content")
+        return old_asset
+    return None
+
+
+def collect_builds(
+    artifacts: list[tuple[dict, Path, Path]],
+    digests: dict[Path, str],
+    content_hashes: dict[Path, str],
+    remote_extensions: dict[str, index_pb2.Extension],
+    release_assets: dict[str, dict],
+    icons: dict[str, str],
+) -> tuple[list[Build], dict[str, dict]]:
+    """
+    returns the index entry of every built extension, sorted by package name,
+    with whether its APK and JAR differ from the published ones, and the
+    release-assets.json entries of all of them
+    """
+    builds = []
+    assets_by_package = {}
+    for info, apk, jar in artifacts:
+        package_name = info["packageName"]
+        old_assets = release_assets.get(package_name, {})
+        published = package_name in remote_extensions
+        assets = {}
+        changed = {}
+        for kind, file in (("apk", apk), ("jar", jar)):
+            asset = {
+                "name": file.name,
+                "sha256": digests[file],
+                "contentHash": content_hashes[file],
+            }
+            kept = get_published_asset(old_assets.get(kind), asset)
+            changed[kind] = not published or kept is None
+            assets[kind] = asset if changed[kind] else kept
+        apk_changed = changed["apk"]
+        jar_changed = changed["jar"]
+
+        assets_by_package[package_name] = assets
+        icon_url = get_icon_url(icons, info["module"], info.get("theme"))
+        builds.append(
+            (create_extension(info, icon_url), apk, jar, apk_changed, jar_changed)
+        )
+
+    builds.sort(key=lambda build: build[0].packageName)
+    return builds, assets_by_package
+
+
+def get_release_tag(url: str) -> str | None:
+    if url.startswith(f"{RELEASE_BASE_URL}/"):
+        return url.removeprefix(f"{RELEASE_BASE_URL}/").split("/", 1)[0]
+    return None
+
+
+def count_release_assets(extensions) -> dict[str, int]:
+    """
+    returns tag -> the number of assets the extensions reference in that release
+    """
+    sizes: dict[str, int] = {}
+    for ext in extensions:
+        for url in (ext.resources.apkUrl, ext.resources.jarUrl):
+            if tag := get_release_tag(url):
+                sizes[tag] = sizes.get(tag, 0) + 1
+    return sizes
+
+
+def measure_release_sizes(
+    referenced: dict[str, int], asset_count: int, get_size
+) -> dict[str, int]:
+    """
+    returns tag -> the assets actually in the referenced releases that may be
+    topped up, fullest first, until they have room for asset_count assets.
+    get_size lists a release; referenced counts are a lower bound on its
+    size, so releases they already fill aren't listed
+    """
+    capacity = 2 * ASSET_LIMIT
+    sizes = {}
+    room = 0
+    for tag in sorted(
+        (tag for tag, size in referenced.items() if size < capacity),
+        key=lambda tag: (-referenced[tag], tag),
+    ):
+        if room >= asset_count:
+            break
+        size = get_size(tag)
+        if size is None:
+            continue
+        sizes[tag] = size
+        room += max(capacity - size, 0)
+    return sizes
+
+
+def pack_releases(
+    changed: list[tuple[int, set[str]]], sizes: dict[str, int]
+) -> tuple[list[str | int], dict[str | int, int]]:
+    """
+    assigns each changed extension, given as (asset count, tags to avoid), to a
+    release. releases in sizes with room are topped up fullest first; the rest go to new
+    releases, returned as ints 0..n-1. returns each extension's release and
+    the assets added to every release
+    """
+    capacity = 2 * ASSET_LIMIT
+    open_releases: list[str | int] = sorted(
+        (tag for tag, size in sizes.items() if size < capacity),
+        key=lambda tag: (-sizes[tag], tag),
+    )
+    loads = {tag: sizes[tag] for tag in open_releases}
+    assignments = []
+    for asset_count, avoid in changed:
+        release = next(
+            (
+                r
+                for r in open_releases
+                if r not in avoid and loads[r] + asset_count <= capacity
+            ),
+            None,
+        )
+        if release is None:
+            release = sum(isinstance(r, int) for r in loads)
+            open_releases.append(release)
+            loads[release] = 0
+        loads[release] += asset_count
+        assignments.append(release)
+
+    return assignments, {
+        release: load - sizes.get(release, 0)
+        for release, load in loads.items()
+        if load > sizes.get(release, 0)
+    }
+
+
+def get_clobbered_tags(
+    remote_extensions: dict[str, index_pb2.Extension], build: Build
+) -> set[str]:
+    """
+    returns the releases where uploading this build would replace an asset
+    the published index still serves, i.e. a rebuild under an unchanged file name
+    """
+    ext, apk, jar, apk_changed, jar_changed = build
+    if ext.packageName not in remote_extensions:
+        return set()
+    old_resources = remote_extensions[ext.packageName].resources
+    return {
+        get_release_tag(old_url)
+        for old_url, file, changed in (
+            (old_resources.apkUrl, apk, apk_changed),
+            (old_resources.jarUrl, jar, jar_changed),
+        )
+        if changed and old_url.endswith(f"/{file.name}")
+    }
+
+
+def assign_releases(
+    builds: list[Build],
+    remote_extensions: dict[str, index_pb2.Extension],
+    release_sizes: dict[str, int],
+    sha: str,
+) -> dict[str, list[Path]]:
+    """
+    points every build's asset urls at its release, keeping the published
+    urls of unchanged assets. release_sizes holds the releases that may be
+    topped up. returns tag -> files to upload
+    """
+    changed_builds = [build for build in builds if build[3] or build[4]]
+
+    assignments, added_assets = pack_releases(
+        [
+            (build[3] + build[4], get_clobbered_tags(remote_extensions, build))
+            for build in changed_builds
+        ],
+        release_sizes,
+    )
+    new_release_count = sum(isinstance(release, int) for release in added_assets)
+
+    def get_tag(release: str | int) -> str:
+        if isinstance(release, str):
+            return release
+        return f"{sha[:7]}-{release}" if new_release_count > 1 else sha[:7]
+
+    for ext, _, _, apk_changed, jar_changed in builds:
+        if not (apk_changed or jar_changed):
+            old_resources = remote_extensions[ext.packageName].resources
+            ext.resources.apkUrl = old_resources.apkUrl
+            ext.resources.jarUrl = old_resources.jarUrl
+
+    batches: dict[str, list[Path]] = {}
+    for (ext, apk, jar, apk_changed, jar_changed), release in zip(
+        changed_builds, assignments
+    ):
+        tag = get_tag(release)
+        old_resources = remote_extensions.get(ext.packageName)
+        ext.resources.apkUrl = (
+            f"{RELEASE_BASE_URL}/{tag}/{apk.name}"
+            if apk_changed
+            else old_resources.resources.apkUrl
+        )
+        ext.resources.jarUrl = (
+            f"{RELEASE_BASE_URL}/{tag}/{jar.name}"
+            if jar_changed
+            else old_resources.resources.jarUrl
+        )
+        batches.setdefault(tag, []).extend(
+            file
+            for file, changed in ((apk, apk_changed), (jar, jar_changed))
+            if changed
+        )
+
+    return batches
+
+
+def update_input_hashes(
+    input_hashes: dict[str, str],
+    to_delete: list[str],
+    artifacts: list[tuple[dict, Path, Path]],
+) -> dict[str, str]:
+    """
+    returns the recorded input hashes minus the deleted modules, plus those
+    of the fresh builds. builds without one (e.g. found without a manifest)
+    stay unrecorded, so the matrix generator never skips them
+    """
+    deleted = {f":src:{module.replace('.', ':')}" for module in to_delete}
+    hashes = {
+        module: input_hash
+        for module, input_hash in input_hashes.items()
+        if module not in deleted
+    }
+    for info, _, _ in artifacts:
+        module = f":src:{info['module'].replace('.', ':')}"
+        if "inputHash" in info:
+            hashes[module] = info["inputHash"]
+        else:
+            hashes.pop(module, None)
+    return hashes
+
+
+def create_index(extensions) -> index_pb2.Index:
+    return index_pb2.Index(
+        name="Keiyoushi",
+        badgeLabel="KEI",
+        signingKey="9add655a78e96c4ec7a53ef89dccb557cb5d767489fac5e785d671a5a75d4da2",
+        contact=index_pb2.Contact(
+            website="https://keiyoushi.github.io",
+            discord="https://discord.gg/3FbCpdKbdY",
+        ),
+        extensionList=index_pb2.ExtensionList(extensions=extensions),
+    )
+
+
+def write_outputs(
+    remote_proto: index_pb2.Index,
+    index: index_pb2.Index,
+    repo_dir: Path,
+    sharding: str | None = INDEX_SHARDING,
+    codecs: list[str] = INDEX_CODECS,
+) -> None:
+    """
+    writes the index in every format, its delta against the published one,
+    and the configured compressed variants and shards
+    """
+    write_index(index, repo_dir)
+    if delta := write_delta(remote_proto, index, repo_dir):
+        print(
+            f"Wrote index delta: {len(delta['added'])} added, "
+            f"{len(delta['updated'])} updated, {len(delta['removed'])} removed"
+        )
+    if codecs:
+        print("Compressed index variants:")
+        print_compression_report(write_compressed_variants(index, repo_dir, codecs))
+    if sharding:
+        shard_urls = write_shards(index, repo_dir, sharding, INDEX_BASE_URL)
+        print(f"Wrote {len(shard_urls)} index shards")
+
+
+class ReleaseUploader:
+    """
+    Uploads batches of files as GitHub releases. Releases are uploaded
+    concurrently, paced by a shared rate limiter. Re-running is safe: existing
+    releases are reused and assets whose digest already matches are skipped.
+    """
+
+    def __init__(self, sha: str, digests: dict[Path, str]):
+        self.sha = sha
+        self.digests = digests
+        self.client = get_client()
+        self.rate_limiter = RateLimiter()
+
+    def find_release(self, tag: str) -> dict | None:
+        # Draft releases can't be looked up by tag, so scan the (ETag-cached) release list.
+        return next(
+            (
+                release
+                for release in self.client.get_pages(f"repos/{REPO_NAME}/releases")
+                if release["tag_name"] == tag
+            ),
+            None,
+        )
+
+    def create_release(self, tag: str) -> dict:
+        if release := self.find_release(tag):
+            print(f"Release {tag} already exists")
+            return release
+
+        print(f"Creating release {tag}")
+        self.rate_limiter.acquire()
+        return self.client.request(
+            "POST",
+            f"repos/{REPO_NAME}/releases",
+            json_body={
+                "tag_name": tag,
+                "name": f"Repository Update {tag}",
+                "body": f"Automated update from keiyoushi/extensions-source@{self.sha}",
+                "draft": True,
+            },
+        ).json()
+
+    def publish_release(self, release: dict) -> None:
+        print(f"Publishing release {release['tag_name']}")
+        self.rate_limiter.acquire()
+        self.client.request(
+            "PATCH",
+            f"repos/{REPO_NAME}/releases/{release['id']}",
+            json_body={"draft": False},
+        )
+
+    def get_release_size(self, tag: str) -> int | None:
+        """
+        returns the number of assets in a release, or None if there's no such release
+        """
+        if release := self.find_release(tag):
+            return len(self.get_release_assets(release))
+        return None
+
+    def get_release_assets(self, release: dict) -> dict[str, dict]:
+        return {
+            asset["name"]: asset
+            for asset in self.client.get_pages(
+                f"repos/{REPO_NAME}/releases/{release['id']}/assets"
+            )
+        }
+
+    def upload_asset(self, release: dict, file: Path, existing: dict | None) -> None:
+        # Replace a stale asset with the same name, like `gh release upload --clobber`.
+        if existing is not None:
+            self.rate_limiter.acquire()
+            self.client.request(
+                "DELETE", f"repos/{REPO_NAME}/releases/assets/{existing['id']}"
+            )
+        self.client.upload_asset(release, file)
+
+    def upload_assets(self, release: dict, files: list[Path]) -> None:
+        if not files:
+            return
+
+        tag = release["tag_name"]
+        existing_assets = self.get_release_assets(release)
+        files_to_upload = [
+            file
+            for file in files
+            if (existing_assets.get(file.name, {}).get("digest") or "").removeprefix(
+                "sha256:"
+            )
+            != self.digests[file]
+        ]
+        skipped = len(files) - len(files_to_upload)
+        count("assets uploaded", len(files_to_upload))
+        count("assets skipped", skipped)
+        if len(existing_assets.keys() | {f.name for f in files}) > RELEASE_ASSET_LIMIT:
+            raise RuntimeError(f"{tag} would exceed {RELEASE_ASSET_LIMIT} assets")
+        print(f"Uploading {len(files_to_upload)} assets to {tag}, skipping {skipped}")
+
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            for i in range(0, len(files_to_upload), UPLOAD_CHUNK_SIZE):
+                chunk = files_to_upload[i : i + UPLOAD_CHUNK_SIZE]
+                self.rate_limiter.acquire(len(chunk))
+                print(
+                    f"  {tag}: assets {i + 1}-{i + len(chunk)} of {len(files_to_upload)}"
+                )
+                for future in [
+                    executor.submit(
+                        self.upload_asset, release, file, existing_assets.get(file.name)
+                    )
+                    for file in chunk
+                ]:
+                    future.result()
+        if release["draft"]:
+            self.publish_release(release)
+
+    def publish_batch(self, tag: str, files: list[Path]) -> None:
+        self.upload_assets(self.create_release(tag), files)
+
+    def upload(self, batches: dict[str, list[Path]]) -> None:
+        with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as executor:
+            futures = [
+                executor.submit(self.publish_batch, tag, files)
+                for tag, files in batches.items()
+            ]
+            for future in futures:
+                future.result()
+
+
+def publish(
+    to_delete: list[str],
+    sha: str,
+    repo_dir: Path,
+    artifacts_dir: Path = ARTIFACTS_DIR,
+    source_dir: Path = SOURCE_DIR,
+    dry_run: bool = False,
+) -> dict[str, list[Path]]:
+    """
+    rebuilds the repo in repo_dir from the published index and the downloaded
+    artifacts, dropping the to_delete modules, then uploads the changed assets.
+    a dry run writes the repo files but makes no GitHub calls. returns the
+    files uploaded (or to upload) per release tag
+    """
+    with stage("load index"):
+        remote_proto = load_index(repo_dir)
+        release_assets = load_json(repo_dir / RELEASE_ASSETS_FILE)
+        input_hashes = load_json(repo_dir / HASHES_FILE)
+    remote_extensions = {
+        ext.packageName: ext for ext in remote_proto.extensionList.extensions
+    }
+
+    with stage("discover artifacts"):
+        artifacts, digests = discover_artifacts(artifacts_dir)
+        icons = list_icons(source_dir)
+    # Every digest is computed once here and reused by the upload skip check. Artifacts
+    # described by a manifest were already hashed in their build job.
+    with stage("hash"):
+        digests.update(
+            hash_files(
+                [
+                    file
+                    for _, apk, jar in artifacts
+                    for file in (apk, jar)
+                    if file not in digests
+                ]
+            )
+        )
+        # Only the central directories are read, so this is cheap next to hashing.
+        content_hashes = hash_zip_contents(
+            [file for _, apk, jar in artifacts for file in (apk, jar)]
+        )
+
+    with stage("diff"):
+        builds, built_assets = collect_builds(
+            artifacts,
+            digests,
+            content_hashes,
+            remote_extensions,
+            release_assets,
+            icons,
+        )
+        # Only releases the published index still references are topped up. A release without
+        # references may already be queued for deletion by cleanup-releases, so it's left alone.
+        # Their assets are listed, since superseded ones stay until cleanup-releases runs; a
+        # dry run makes no calls and estimates from the references alone.
+        referenced = count_release_assets(remote_proto.extensionList.extensions)
+        uploader = None if dry_run else ReleaseUploader(sha, digests)
+        release_sizes = (
+            referenced
+            if uploader is None
+            else measure_release_sizes(
+                referenced,
+                sum(build[3] + build[4] for build in builds),
+                uploader.get_release_size,
+            )
+        )
+        batches = assign_releases(builds, remote_extensions, release_sizes, sha)
+    count("extensions built", len(builds))
+    count("extensions changed", sum(build[3] or build[4] for build in builds))
+
+    with stage("merge"):
+        # Merge with the already-published index, dropping the deleted/rebuilt modules.
+        index = create_index(
+            merge_extensions(
+                remote_proto.extensionList.extensions,
+                (build[0] for build in builds),
+                to_delete,
+            )
+        )
+
+    with stage("write index"):
+        write_outputs(remote_proto, index, repo_dir)
+        save_json(
+            repo_dir / RELEASE_ASSETS_FILE,
+            drop_modules(release_assets, to_delete) | built_assets,
+        )
+        save_json(
+            repo_dir / HASHES_FILE,
+            update_input_hashes(input_hashes, to_delete, artifacts),
+        )
+
+    if dry_run:
+        for tag, files in batches.items():
+            print(f"Would upload {len(files)} assets to {tag}")
+    elif batches:
+        with stage("upload"):
+            uploader.upload(batches)
+
+    return batches
+
+
+def create_synthetic_artifacts(
+    artifacts_dir: Path, extension_count: int, manifest: bool = True
+) -> None:
+    """
+    writes one build artifact of extension_count extensions matching
+    create_synthetic_index, with small random APKs and JARs
+    """
+    root = artifacts_dir / "individual-apks-1"
+    modules = []
+    for i, ext in enumerate(
+        create_synthetic_index(extension_count).extensionList.extensions
+    ):
+        lang, name = ext.packageName.split(".")[-2:]
+        module = f":src:{lang}:{name}"
+        build_dir = root / "src" / lang / name / "build"
+        info = {
+            "name": ext.name,
+            "packageName": ext.packageName,
+            "module": f"{lang}.{name}",
+            "extensionLib": ext.extensionLib,
+            "versionCode": ext.versionCode + 1,
+            "versionName": f"{ext.extensionLib}.{ext.versionCode + 1}",
+            "contentWarning": index_pb2.ContentWarning.Name(ext.contentWarning),
+            "sources": [
+                {
+                    "id": str(source.id),
+                    "name": source.name,
+                    "lang": source.language,
+                    "baseUrl": source.homeUrl,
+                }
+                for source in ext.sources
+            ],
+        }
+        build_dir.mkdir(parents=True)
+        (build_dir / "keiyoushi-source-info.json").write_text(json.dumps(info))
+        for kind in ("apk", "jar"):
+            output = build_dir / "outputs" / kind / "release"
+            output.mkdir(parents=True)
+            file = output / f"tachiyomi-{lang}.{name}-v{info['versionName']}.{kind}"
+            with zipfile.ZipFile(file, "w") as z:
+                z.writestr("classes.dex", os.urandom(4096 + i % 4096))
+        modules.append(module)
+
+    if manifest:
+        write_manifest(modules, root)
+
+
+def benchmark(extension_count: int, rounds: int, manifest: bool) -> dict[str, float]:
+    """
+    runs dry-run publishes of a synthetic artifacts tree on top of a
+    synthetic published index of the same size. returns the mean duration
+    of each stage in milliseconds
+    """
+    published = create_synthetic_index(extension_count)
+    # Like in CI, every rebuilt module is also passed for deletion.
+    rebuilt = [
+        get_module(ext.packageName) for ext in published.extensionList.extensions
+    ]
+    totals: dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        artifacts_dir = Path(directory) / "artifacts"
+        create_synthetic_artifacts(artifacts_dir, extension_count, manifest)
+
+        for _ in range(rounds):
+            repo_dir = Path(directory) / "repo"
+            repo_dir.mkdir()
+            write_index(published, repo_dir)
+            reset()
+
+            start = time.perf_counter()
+            batches = publish(rebuilt, "0" * 40, repo_dir, artifacts_dir, dry_run=True)
+            totals["total"] = totals.get("total", 0.0) + time.perf_counter() - start
+            uploaded = sum(len(files) for files in batches.values())
+            if uploaded != 2 * extension_count:
+                raise RuntimeError(
+                    f"Expected {2 * extension_count} assets to upload, got {uploaded}"
+                )
+            for name, seconds in get_summary()["stages"].items():
+                totals[name] = totals.get(name, 0.0) + seconds
+
+            shutil.rmtree(repo_dir)
+
+    return {name: seconds / rounds * 1000 for name, seconds in totals.items()}
+
+
+def check_benchmark(results: dict[str, float], baseline: dict) -> str | None:
+    """
+    returns why the results are slower than the baseline allows, or None
+    """
+    limit = baseline["stages"]["total"] * BENCHMARK_TOLERANCE
+    if results["total"] > limit:
+        return (
+            f"Publish took {results['total']:.1f} ms, over the {limit:.1f} ms allowed "
+            f"by the {baseline['stages']['total']:.1f} ms baseline"
+        )
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark a dry-run publish against synthetic artifacts"
+    )
+    parser.add_argument("--extensions", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument(
+        "--no-manifest",
+        action="store_true",
+        help="make the publisher search and hash the artifacts itself",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="run the baseline's settings and fail when slower, if there is a baseline",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help=f"record the results in {BENCHMARK_BASELINE_FILE}",
+    )
+    args = parser.parse_args()
+
+    baseline = load_json(BENCHMARK_BASELINE_FILE)
+    if args.check and not baseline:
+        print(f"No baseline at {BENCHMARK_BASELINE_FILE}; nothing to check against")
+    elif args.check:
+        args.extensions = baseline["extensions"]
+        args.rounds = baseline["rounds"]
+        args.no_manifest = not baseline["manifest"]
+
+    results = benchmark(args.extensions, args.rounds, not args.no_manifest)
+    print(
+        f"{args.extensions} extensions, {args.rounds} rounds, "
+        f"{'without' if args.no_manifest else 'with'} manifest"
+    )
+    for name, milliseconds in results.items():
+        print(f"  {name:<20} {milliseconds:8.1f} ms")
+
+    failure = args.check and baseline and check_benchmark(results, baseline)
+    if args.save_baseline and not failure:
+        BENCHMARK_BASELINE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        save_json(
+            BENCHMARK_BASELINE_FILE,
+            {
+                "extensions": args.extensions,
+                "rounds": args.rounds,
+                "manifest": not args.no_manifest,
+                "stages": {name: round(ms, 1) for name, ms in results.items()},
+            },
+        )
+    if failure:
+        sys.exit(failure)
+
+
+if __name__ == "__main__":
+    main()
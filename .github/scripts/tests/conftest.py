@@ -0,0 +1,44 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+import github_utils
+import metrics
+from fake_github import serve
+from github_utils import GitHubClient
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+
+
+@pytest.fixture
+def fake_github():
+    server, github = serve()
+    yield github
+    server.shutdown()
+
+
+@pytest.fixture
+def client(fake_github, monkeypatch):
+    client = GitHubClient(
+        token="token",
+        api_url=fake_github.base_url,
+        uploads_url=f"{fake_github.base_url}/uploads",
+    )
+    # Everything going through get_client(), like ReleaseUploader, talks to the fake.
+    monkeypatch.setattr(github_utils, "_client", client)
+    return client
+
+
+@pytest.fixture
+def cleanup_releases():
+    # The script's file name isn't importable as a module name.
+    spec = importlib.util.spec_from_file_location(
+        "cleanup_releases", Path(__file__).parents[1] / "cleanup-releases.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
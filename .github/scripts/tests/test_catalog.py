@@ -0,0 +1,52 @@
+from module_graph import parse_build_file
+
+BUILD_FILE = """
+keiyoushi {
+    name = "Example"
+    versionCode = 3
+    contentWarning = ContentWarning.NSFW
+    libVersion = "1.4"
+
+    listOf(
+        "en", "fr",
+        "pt-BR",
+    ).forEach { language ->
+        source {
+            lang = language
+            baseUrl = "https://example.com/$language" // one site per language
+        }
+    }
+    listOf("it").forEach {
+        source {
+            lang = it
+            baseUrl = mirrorUrl
+        }
+    }
+    locales.forEach { (langCode, locale) ->
+        source {
+            lang = langCode
+        }
+    }
+}
+
+dependencies {
+    implementation(project(":lib:i18n"))
+}
+"""
+
+
+def test_parse_build_file_expands_list_loops():
+    info = parse_build_file(BUILD_FILE)
+
+    assert info["name"] == "Example"
+    assert info["versionCode"] == 3
+    assert info["contentWarning"] == "NSFW"
+    assert info["dependencies"] == [":lib:i18n"]
+    assert info["sources"] == [
+        {"lang": "en", "baseUrl": "https://example.com/en"},
+        {"lang": "fr", "baseUrl": "https://example.com/fr"},
+        {"lang": "pt-BR", "baseUrl": "https://example.com/pt-BR"},
+        {"lang": "it", "baseUrl": {"expr": "mirrorUrl"}},
+        # Values of any other loop can't be known, so they stay expressions.
+        {"lang": {"expr": "langCode"}},
+    ]
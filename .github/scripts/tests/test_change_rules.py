@@ -0,0 +1,117 @@
+import subprocess
+
+import pytest
+
+from change_rules import (
+    FULL,
+    LIB_VERSION,
+    LIB_VERSION_FILE,
+    LINT,
+    NO_BUILD,
+    PUBLISH,
+    classify_commit,
+)
+
+VERSION_CATALOG = """[libraries]
+tachiyomi-lib-v14 = {{ module = "com.github.keiyoushi:extensions-lib", version = "{v14}" }}
+tachiyomi-lib-v16 = {{ module = "com.github.keiyoushi:extensions-lib", version = "{v16}" }}
+okhttp = {{ module = "com.squareup.okhttp3:okhttp", version = "{okhttp}" }}
+"""
+
+# Path sets of commits this repo has seen, and the impact each must keep.
+HISTORY_EXAMPLES = [
+    # matrix generator and build scheduler
+    (
+        [
+            ".github/scripts/generate-build-matrices.py",
+            ".github/scripts/build_scheduler.py",
+        ],
+        NO_BUILD,
+    ),
+    ([".github/scripts/publish-repo.py"], PUBLISH),
+    # cleanup-releases.py and the fake API
+    (
+        [
+            ".github/scripts/cleanup-releases.py",
+            ".github/scripts/tests/fake_github.py",
+        ],
+        NO_BUILD,
+    ),
+    (["settings.gradle.kts"], FULL),
+    (["ext-bootstrap.py", ".github/scripts/catalog.py", "CONTRIBUTING.md"], NO_BUILD),
+    (
+        [".github/scripts/publisher.py", ".github/scripts/artifact_manifest.py"],
+        PUBLISH,
+    ),
+    ([".github/workflows/scripts_test.yml"], NO_BUILD),
+    # input_hashes.py, which the publisher imports
+    ([".github/scripts/input_hashes.py", "src/en/mangadex/build.gradle.kts"], PUBLISH),
+    # the highest impact wins
+    ([".github/scripts/publisher.py", "core/src/test/kotlin/UtilsTest.kt"], LINT),
+    (["README.md", "core/src/main/kotlin/keiyoushi/utils/Json.kt"], FULL),
+]
+
+
+def commit_catalog(repo, **versions) -> str:
+    catalog = repo / LIB_VERSION_FILE
+    catalog.parent.mkdir(exist_ok=True)
+    catalog.write_text(
+        VERSION_CATALOG.format(**({"v14": "a", "v16": "b", "okhttp": "5"} | versions))
+    )
+    subprocess.run(["git", "add", "-A"], cwd=repo, check=True)
+    subprocess.run(
+        ["git", "commit", "-q", "--allow-empty", "-m", str(versions)],
+        cwd=repo,
+        check=True,
+    )
+    return head(repo)
+
+
+def commit_paths(repo, paths: list[str]) -> str:
+    for path in paths:
+        file = repo / path
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(f"{file.read_text() if file.exists() else ''}change\n")
+    subprocess.run(["git", "add", "-A"], cwd=repo, check=True)
+    subprocess.run(["git", "commit", "-q", "-m", "change"], cwd=repo, check=True)
+    return head(repo)
+
+
+def head(repo) -> str:
+    return subprocess.run(
+        ["git", "rev-parse", "HEAD"], cwd=repo, capture_output=True, text=True
+    ).stdout.strip()
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    for args in (
+        ["init", "-q"],
+        ["config", "user.name", "test"],
+        ["config", "user.email", "test@example.com"],
+    ):
+        subprocess.run(["git", *args], cwd=tmp_path, check=True)
+    monkeypatch.chdir(tmp_path)
+    commit_catalog(tmp_path)
+    return tmp_path
+
+
+def test_v14_bump_only_rebuilds_v14_modules(repo):
+    assert classify_commit(commit_catalog(repo, v14="c"))[:2] == (LIB_VERSION, {"1.4"})
+
+
+@pytest.mark.parametrize(
+    "versions", [{"v16": "c"}, {"v14": "c", "v16": "c"}, {"okhttp": "6"}]
+)
+def test_other_catalog_changes_rebuild_everything(repo, versions):
+    # :core and the libs are compiled against v16, and every extension links them in.
+    assert classify_commit(commit_catalog(repo, **versions))[:2] == (FULL, None)
+
+
+def test_initial_commit_rebuilds_everything(repo):
+    assert classify_commit(head(repo))[0] == FULL
+
+
+@pytest.mark.parametrize("paths, expected", HISTORY_EXAMPLES)
+def test_history_examples_keep_their_impact(repo, paths, expected):
+    assert classify_commit(commit_paths(repo, paths))[0] == expected
@@ -0,0 +1,96 @@
+import json
+import sys
+
+from github_utils import REPO_NAME, RELEASE_DOWNLOAD_URL
+
+
+def get_url(tag: str, name: str) -> str:
+    return f"{RELEASE_DOWNLOAD_URL}{tag}/{name}"
+
+
+def test_topped_up_release_is_rechecked(
+    fake_github, client, cleanup_releases, tmp_path, monkeypatch, capsys
+):
+    # More assets than the listing embeds, so the release is only skippable via the cache.
+    names = [f"tachiyomi-en.ext{i}-v1.4.1.apk" for i in range(120)]
+    release = fake_github.add_release(REPO_NAME, {"tag_name": "abc1234"})
+    for name in names:
+        fake_github.add_asset(REPO_NAME, release, name, 1, None)
+    index = {
+        "extensionList": {
+            "extensions": [
+                {"resources": {"apkUrl": get_url("abc1234", name), "jarUrl": ""}}
+                for name in names
+            ]
+        }
+    }
+    fake_github.contents[REPO_NAME] = {"index.json": json.dumps(index)}
+    cache = tmp_path / "referenced-releases.json"
+    monkeypatch.setattr(
+        sys, "argv", ["cleanup-releases.py", "--referenced-cache", str(cache)]
+    )
+
+    cleanup_releases.main()
+    assert json.loads(cache.read_text())[str(release["id"])]["assets"] == 120
+
+    cleanup_releases.main()
+    assert "(1 skipped as fully referenced)" in capsys.readouterr().out
+
+    # A publish tops the release up with an asset that's superseded before cleanup runs.
+    fake_github.add_asset(REPO_NAME, release, "tachiyomi-en.stale-v1.4.1.apk", 1, None)
+    cleanup_releases.main()
+
+    assert "(0 skipped as fully referenced)" in capsys.readouterr().out
+    assert sorted(asset["name"] for asset in release["assets"]) == sorted(names)
+
+
+def create_run(run_id: int, created_at: str, updated_at: str, jobs: list) -> dict:
+    return {
+        "id": run_id,
+        "status": "completed",
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "jobs": jobs,
+    }
+
+
+def create_publish_job(job_id: int, status: str, completed_at: str | None) -> dict:
+    return {
+        "id": job_id,
+        "name": "Publish extension repo",
+        "status": status,
+        "conclusion": "success" if completed_at else None,
+        "completed_at": completed_at,
+    }
+
+
+def test_rerun_of_an_older_run_is_the_latest_publish(
+    fake_github, client, cleanup_releases
+):
+    fake_github.workflow_runs[cleanup_releases.SOURCE_REPO] = [
+        create_run(
+            2,
+            "2026-10-18T11:00:00Z",
+            "2026-10-18T11:20:00Z",
+            [create_publish_job(20, "completed", "2026-10-18T11:20:00Z")],
+        ),
+        # Re-run after the newer run, so it published last despite its creation time.
+        create_run(
+            1,
+            "2026-10-18T10:00:00Z",
+            "2026-10-18T12:30:00Z",
+            [create_publish_job(10, "completed", "2026-10-18T12:30:00Z")],
+        ),
+    ]
+    runs = cleanup_releases.get_workflow_runs()
+
+    assert cleanup_releases.get_latest_publish_job(runs)["id"] == 10
+
+    # A publish job that hasn't finished yet blocks, whatever run it belongs to.
+    fake_github.workflow_runs[cleanup_releases.SOURCE_REPO][1] |= {
+        "status": "in_progress",
+        "updated_at": "2026-10-18T13:00:00Z",
+        "jobs": [create_publish_job(11, "in_progress", None)],
+    }
+    runs = cleanup_releases.get_workflow_runs()
+    assert cleanup_releases.get_latest_publish_job(runs)["id"] == 11
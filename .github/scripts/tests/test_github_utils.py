@@ -0,0 +1,114 @@
+import hashlib
+import types
+
+import github_utils
+from github_utils import REPO_NAME, RateLimiter
+from metrics import get_summary
+from publisher import ReleaseUploader
+
+
+def sha256(file) -> str:
+    return hashlib.sha256(file.read_bytes()).hexdigest()
+
+
+def test_get_pages_follows_links_and_revalidates_etags(fake_github, client):
+    for i in range(150):
+        fake_github.add_release(REPO_NAME, {"tag_name": f"tag-{i}"})
+
+    first = client.get_pages(f"repos/{REPO_NAME}/releases")
+    second = client.get_pages(f"repos/{REPO_NAME}/releases")
+
+    assert [release["tag_name"] for release in first] == [
+        f"tag-{i}" for i in reversed(range(150))
+    ]
+    assert second == first
+    assert get_summary()["counters"]["api calls not modified"] == 2
+
+
+def test_release_uploader_uploads_skips_and_clobbers(fake_github, client, tmp_path):
+    apk = tmp_path / "tachiyomi-en.test-v1.4.1.apk"
+    jar = tmp_path / "tachiyomi-en.test-v1.4.1.jar"
+    apk.write_bytes(b"apk")
+    jar.write_bytes(b"jar")
+
+    ReleaseUploader("abc1234def", {apk: sha256(apk), jar: sha256(jar)}).upload(
+        {"abc1234": [apk, jar]}
+    )
+
+    (release,) = fake_github.releases[REPO_NAME]
+    assert release["tag_name"] == "abc1234"
+    assert not release["draft"]
+    assert sorted(asset["name"] for asset in release["assets"]) == [apk.name, jar.name]
+
+    # A re-run skips assets whose digest already matches and replaces the rest.
+    apk.write_bytes(b"rebuilt apk")
+    ReleaseUploader("abc1234def", {apk: sha256(apk), jar: sha256(jar)}).upload(
+        {"abc1234": [apk, jar]}
+    )
+
+    assets = {asset["name"]: asset for asset in release["assets"]}
+    assert len(assets) == 2
+    assert assets[apk.name]["digest"] == f"sha256:{sha256(apk)}"
+    counters = get_summary()["counters"]
+    assert counters["assets uploaded"] == 3
+    assert counters["assets skipped"] == 1
+
+
+class FakeClock:
+    def __init__(self, limiter: RateLimiter):
+        self.now = 0.0
+        self.limiter = limiter
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        # Other threads may reserve their slots while this one waits.
+        assert not self.limiter.lock.locked()
+        self.now += seconds
+
+
+def create_paced_limiter(monkeypatch) -> tuple[RateLimiter, FakeClock]:
+    # The fake API reports plenty of the primary limit left, resetting long after
+    # the fake clock's start, so only the content pacing applies.
+    limiter = RateLimiter()
+    clock = FakeClock(limiter)
+    monkeypatch.setattr(
+        github_utils,
+        "time",
+        types.SimpleNamespace(time=clock.time, sleep=clock.sleep),
+    )
+    return limiter, clock
+
+
+def test_rate_limiter_fits_a_full_republish_in_the_publish_job(client, monkeypatch):
+    limiter, clock = create_paced_limiter(monkeypatch)
+
+    # A full republish uploads about 2,800 assets; the publish job has 120 minutes.
+    for _ in range(2800):
+        limiter.acquire()
+
+    assert clock.now < 40 * 60
+
+
+def test_rate_limiter_waits_for_githubs_retry_after(client, monkeypatch):
+    limiter, clock = create_paced_limiter(monkeypatch)
+    client.retry_at = 90.0
+
+    limiter.acquire()
+
+    assert clock.now == 90.0
+
+
+def test_rate_limiter_without_content_pacing_only_waits_for_github(client, monkeypatch):
+    # cleanup-releases deletes this way; a large backlog must fit its 240-minute job.
+    limiter, clock = create_paced_limiter(monkeypatch)
+    limiter.per_minute = None
+
+    for _ in range(3000):
+        limiter.acquire()
+    assert clock.now == 0.0
+
+    client.retry_at = 30.0
+    limiter.acquire()
+    assert clock.now == 30.0
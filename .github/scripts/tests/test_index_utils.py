@@ -0,0 +1,158 @@
+import json
+import random
+from pathlib import Path
+
+import index_pb2
+from index_utils import (
+    DELTA_DIR,
+    apply_delta,
+    create_synthetic_index,
+    drop_modules,
+    get_index_hash,
+    get_module,
+    merge_extensions,
+    write_delta,
+    write_shards,
+)
+
+REPO_ROOT = Path(__file__).parents[3]
+PACKAGE_PREFIX = "eu.kanade.tachiyomi.extension"
+
+
+def get_repo_modules() -> list[str]:
+    return sorted(
+        f"{extension.parent.name}.{extension.name}"
+        for extension in REPO_ROOT.glob("src/*/*")
+        if extension.is_dir()
+    )
+
+
+def create_extension(module: str, version: int = 1) -> index_pb2.Extension:
+    return index_pb2.Extension(
+        name=module, packageName=f"{PACKAGE_PREFIX}.{module}", versionCode=version
+    )
+
+
+def test_get_module():
+    assert get_module(f"{PACKAGE_PREFIX}.en.mangadex") == "en.mangadex"
+    assert get_module(f"{PACKAGE_PREFIX}.all.mangadex") == "all.mangadex"
+
+
+def test_drop_modules():
+    release_assets = {
+        f"{PACKAGE_PREFIX}.en.comic": {"apk": {}},
+        f"{PACKAGE_PREFIX}.en.xcomic": {"apk": {}},
+        f"{PACKAGE_PREFIX}.fr.comic": {"apk": {}},
+    }
+
+    assert drop_modules(release_assets, ["en.comic"]) == {
+        f"{PACKAGE_PREFIX}.en.xcomic": {"apk": {}},
+        f"{PACKAGE_PREFIX}.fr.comic": {"apk": {}},
+    }
+    assert drop_modules(release_assets, []) == release_assets
+
+
+def test_merge_extensions_replaces_rebuilt_and_drops_deleted():
+    published = [create_extension(m) for m in ("en.b", "en.a", "fr.c", "ja.d")]
+    built = [create_extension("en.a", version=2), create_extension("ko.e")]
+
+    merged = merge_extensions(published, built, ["en.a", "fr.c", "ko.e"])
+
+    assert [(ext.packageName, ext.versionCode) for ext in merged] == [
+        (f"{PACKAGE_PREFIX}.en.a", 2),
+        (f"{PACKAGE_PREFIX}.en.b", 1),
+        (f"{PACKAGE_PREFIX}.ja.d", 1),
+        (f"{PACKAGE_PREFIX}.ko.e", 1),
+    ]
+
+
+def test_module_lookup_matches_suffix_scan():
+    # The publisher used to drop packages by scanning `endswith(f".{module}")`.
+    modules = get_repo_modules()
+    assert modules
+    published = [create_extension(module) for module in modules]
+    release_assets = {ext.packageName: {} for ext in published}
+    rng = random.Random(0)
+
+    for size in (0, 1, 10, len(modules) // 2, len(modules)):
+        to_delete = rng.sample(modules, size)
+        expected = [
+            ext.packageName
+            for ext in published
+            if not any(ext.packageName.endswith(f".{m}") for m in to_delete)
+        ]
+
+        assert list(drop_modules(release_assets, to_delete)) == expected
+        assert [
+            ext.packageName for ext in merge_extensions(published, [], to_delete)
+        ] == sorted(expected)
+
+
+def test_write_shards_keeps_the_previous_generation(tmp_path):
+    generations = []
+    for extension_count in (10, 11, 12):
+        urls = write_shards(
+            create_synthetic_index(extension_count), tmp_path, "hash:2", "https://cdn"
+        )
+        generations.append({url.rsplit("/", 1)[1] for url in urls.values()})
+
+    shards = {path.name for path in (tmp_path / "shards").iterdir()}
+    assert shards == generations[1] | generations[2]
+    # Something from the first generation changed and has been dropped by now.
+    assert generations[0] - shards
+
+
+def create_index_history(count: int) -> list[index_pb2.Index]:
+    """
+    returns successive indexes that add, update and remove extensions and
+    change the index metadata along the way
+    """
+    rng = random.Random(0)
+    index = create_synthetic_index(50)
+    history = [index]
+    for step in range(count):
+        index = index_pb2.Index()
+        index.CopyFrom(history[-1])
+        extensions = list(index.extensionList.extensions)
+        for ext in rng.sample(extensions, 5):
+            ext.versionCode += 1
+            ext.resources.apkUrl = f"{ext.resources.apkUrl}?step={step}"
+        removed = {ext.packageName for ext in rng.sample(extensions, 2)}
+        extensions = [ext for ext in extensions if ext.packageName not in removed]
+        # One extension that never existed before joins every step.
+        extensions.append(
+            create_synthetic_index(51 + step).extensionList.extensions[50 + step]
+        )
+        index.extensionList.ClearField("extensions")
+        index.extensionList.extensions.extend(
+            sorted(extensions, key=lambda ext: ext.packageName)
+        )
+        index.name = f"Keiyoushi {step}"
+        history.append(index)
+    return history
+
+
+def test_delta_chain_reproduces_every_later_index(tmp_path):
+    history = create_index_history(8)
+    for old, new in zip(history, history[1:]):
+        write_delta(old, new, tmp_path)
+
+    manifest = json.loads((tmp_path / DELTA_DIR / "index.json").read_text())
+    deltas = {entry["base"]: entry for entry in manifest["deltas"]}
+    assert manifest["latest"] == get_index_hash(history[-1])
+
+    # A client holding any published index follows the chain up to the latest one.
+    for start in history[:-1]:
+        index = start
+        while get_index_hash(index) != manifest["latest"]:
+            entry = deltas[get_index_hash(index)]
+            delta = json.loads((tmp_path / DELTA_DIR / entry["file"]).read_text())
+            index = apply_delta(index, delta)
+            assert get_index_hash(index) == entry["target"]
+        assert index == history[-1]
+
+
+def test_unchanged_index_writes_no_delta(tmp_path):
+    index = create_synthetic_index(10)
+    assert write_delta(index, index, tmp_path) is None
+    assert not (tmp_path / DELTA_DIR).exists()
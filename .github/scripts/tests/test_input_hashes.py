@@ -0,0 +1,33 @@
+import input_hashes
+from input_hashes import compute_input_hashes, load_published_hashes
+
+BLOBS = {
+    "core/src/main/kotlin/keiyoushi/utils/Json.kt": "a",
+    "core/src/test/kotlin/keiyoushi/utils/JsonTest.kt": "b",
+    "src/en/example/build.gradle.kts": "c",
+}
+
+
+def compute_hashes(monkeypatch, blobs: dict[str, str]) -> dict[str, str]:
+    monkeypatch.setattr(input_hashes, "list_blobs", lambda ref: blobs)
+    monkeypatch.setattr(
+        input_hashes, "build_graph", lambda ref: {":src:en:example": []}
+    )
+    return compute_input_hashes([":src:en:example"])
+
+
+def test_core_tests_dont_change_input_hashes(monkeypatch):
+    hashes = compute_hashes(monkeypatch, BLOBS)
+
+    test_changed = BLOBS | {"core/src/test/kotlin/keiyoushi/utils/JsonTest.kt": "d"}
+    assert compute_hashes(monkeypatch, test_changed) == hashes
+    core_changed = BLOBS | {"core/src/main/kotlin/keiyoushi/utils/Json.kt": "d"}
+    assert compute_hashes(monkeypatch, core_changed) != hashes
+
+
+def test_load_published_hashes_survives_timeouts(monkeypatch):
+    def urlopen(url, timeout):
+        raise TimeoutError("The read operation timed out")
+
+    monkeypatch.setattr(input_hashes, "urlopen", urlopen)
+    assert load_published_hashes("https://example.com/hashes.json") == {}
@@ -0,0 +1,69 @@
+import index_pb2
+import pytest
+from github_utils import REPO_NAME
+from publisher import (
+    BENCHMARK_BASELINE_FILE,
+    RELEASE_BASE_URL,
+    ReleaseUploader,
+    benchmark,
+    check_benchmark,
+    count_release_assets,
+    load_json,
+    measure_release_sizes,
+    pack_releases,
+)
+
+
+def create_extensions(tag: str, count: int) -> list[index_pb2.Extension]:
+    extensions = []
+    for i in range(count):
+        ext = index_pb2.Extension(packageName=f"{tag}.{i}")
+        ext.resources.apkUrl = f"{RELEASE_BASE_URL}/{tag}/{i}.apk"
+        ext.resources.jarUrl = f"{RELEASE_BASE_URL}/{tag}/{i}.jar"
+        extensions.append(ext)
+    return extensions
+
+
+def add_release(fake_github, tag: str, asset_count: int) -> None:
+    release = fake_github.add_release(REPO_NAME, {"tag_name": tag})
+    for i in range(asset_count):
+        fake_github.add_asset(REPO_NAME, release, f"{tag}-{i}.apk", 1, None)
+
+
+def test_releases_are_sized_from_their_asset_listing(fake_github, client):
+    referenced = count_release_assets(
+        create_extensions("old", 100) + create_extensions("small", 5)
+    )
+    assert referenced == {"old": 200, "small": 10}
+    # Most of what "old" holds was superseded, but cleanup-releases hasn't run yet.
+    add_release(fake_github, "old", 990)
+    add_release(fake_github, "small", 10)
+    uploader = ReleaseUploader("abc1234def", {})
+
+    sizes = measure_release_sizes(referenced, 20, uploader.get_release_size)
+    assert sizes == {"old": 990, "small": 10}
+    assignments, _ = pack_releases([(2, set())] * 10, sizes)
+    assert assignments == ["small"] * 10
+
+    # Once cleanup has shrunk it, "old" is topped up again and "small" isn't listed.
+    fake_github.releases[REPO_NAME][-1]["assets"][200:] = []
+    assert measure_release_sizes(referenced, 20, uploader.get_release_size) == {
+        "old": 200
+    }
+
+
+def test_full_releases_spill_into_a_new_release():
+    assignments, added = pack_releases([(2, set())] * 3, {"old": 988})
+    assert assignments == ["old", 0, 0]
+    assert added == {"old": 2, 0: 4}
+
+
+@pytest.mark.benchmark
+def test_publish_benchmark_stays_within_baseline():
+    baseline = load_json(BENCHMARK_BASELINE_FILE)
+    if not baseline:
+        pytest.skip(f"no baseline at {BENCHMARK_BASELINE_FILE}")
+    results = benchmark(
+        baseline["extensions"], baseline["rounds"], baseline["manifest"]
+    )
+    assert check_benchmark(results, baseline) is None
@@ -2,9 +2,13 @@
 
 import argparse
 import re
+import sys
 from pathlib import Path
 from urllib.parse import urlparse
 
+sys.path.insert(0, str(Path(__file__).resolve().parent / ".github" / "scripts"))
+from module_graph import parse_build_file  # noqa: E402
+
 
 def ascii_validator(value: str) -> str:
     value = value.strip()
@@ -54,10 +58,8 @@ def validate_args(args: argparse.Namespace, parser: argparse.ArgumentParser):
             )
         args.multisrc = multisrc_theme
 
-        if (
-            'libVersion = "1.4"'
-            in (multisrc_dir / multisrc_theme / "build.gradle.kts").read_text()
-        ):
+        theme_build_file = multisrc_dir / multisrc_theme / "build.gradle.kts"
+        if parse_build_file(theme_build_file.read_text()).get("libVersion") == "1.4":
             args.is_keisource = False
 
 
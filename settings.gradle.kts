@@ -31,10 +31,23 @@ enableFeaturePreview("TYPESAFE_PROJECT_ACCESSORS")
 rootProject.name = "Keiyoushi"
 
 /**
- * Add or remove modules to load as needed for local development here.
+ * CI build chunks pass the projects they need (see generate-build-matrices.py), so Gradle only
+ * configures those instead of every extension.
  */
-loadAllIndividualExtensions()
-// loadIndividualExtension("all", "mangadex")
+val ciProjects = providers.environmentVariable("CI_PROJECTS").orNull
+    ?.split(" ")
+    ?.filter { it.isNotBlank() }
+    .orEmpty()
+
+if (ciProjects.isNotEmpty()) {
+    ciProjects.forEach { include(it) }
+} else {
+    /**
+     * Add or remove modules to load as needed for local development here.
+     */
+    loadAllIndividualExtensions()
+    // loadIndividualExtension("all", "mangadex")
+}
 
 /**
  * ===================================== COMMON CONFIGURATION ======================================
@@ -42,11 +55,13 @@ loadAllIndividualExtensions()
 include(":core")
 include(":compiler")
 
-// Load all modules under /lib
-File(rootDir, "lib").eachDir { include("lib:${it.name}") }
+if (ciProjects.isEmpty()) {
+    // Load all modules under /lib
+    File(rootDir, "lib").eachDir { include("lib:${it.name}") }
 
-// Load all modules under /lib-multisrc
-File(rootDir, "lib-multisrc").eachDir { include("lib-multisrc:${it.name}") }
+    // Load all modules under /lib-multisrc
+    File(rootDir, "lib-multisrc").eachDir { include("lib-multisrc:${it.name}") }
+}
 
 /**
  * ======================================== HELPER FUNCTION ========================================